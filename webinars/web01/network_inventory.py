@@ -13,13 +13,15 @@ Goals
 		- serial number.
 
 Usage
-	./network_inventory </path/to/testbed_file>
+	./network_inventory </path/to/testbed_file> [--workers N] [--devices DEVICE_LIST]
 """
 
 from pyats.topology.loader import load
 from genie.metaparser.util.exceptions import SchemaEmptyParserError
 from genie.libs.parser.utils.common import ParserNotFound
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
+from table_rows import iter_table_rows
 import csv
 
 """
@@ -127,17 +129,56 @@ def get_inventory(device, show_version, show_inventory):
 
 	return (hostname, device_os, software_version, uptime, serial_number)
 
+"""
+This function collects the inventory record of a single device.
+It connects, runs the show commands, builds the record and disconnects,
+so it can be run for many devices at the same time.
+"""
+def collect_device(device):
+	# Connect to the device, but silent logs
+	device.connect(log_stdout=False)
+
+	try:
+		# Run commands to gather information from network device
+		show_version = {device.name : parse_command(device, 'show version')}
+		show_inventory = {device.name : parse_command(device, 'show inventory')}
+
+		# Build network inventory
+		return get_inventory(device, show_version, show_inventory)
+	finally:
+		# Disconnect from device
+		device.disconnect()
+		print(f'Disconnected successfully from {device.name}')
+
+"""
+This function returns the names of the devices listed in the 'hostname'
+column of a CSV or XLSX file, like the spreadsheet used to create the
+testbed (nso_sandbox_devices.xlsx).
+"""
+def read_device_names(filename):
+	return {row['hostname'] for row in iter_table_rows(filename) if row.get('hostname')}
+
+"""
+This function returns the testbed devices selected by a device list file.
+Without a file, every device in the testbed is selected.
+"""
+def select_devices(testbed, devices_filename=None):
+	if not devices_filename:
+		return list(testbed.devices.values())
+
+	print(f'Reading device list {devices_filename}')
+	names = read_device_names(devices_filename)
+	for name in sorted(names - set(testbed.devices)):
+		print(f'WARNING: Device {name} is not in the testbed')
+	return [device for device in testbed.devices.values() if device.name in names]
+
 # If run as a script
 if __name__ == '__main__':
 	import argparse
 
-	# Empty dictionary to store the output of the 'show version' command
-	# { hostname : {type : output} }
-	show_version = {}
-
-	# Empty dictionary to store the output of the 'show inventory' command
-	# { hostname : {type : output} }
-	show_inventory = {}
+	# Inventory record of each network device
+	# { hostname : (device_name, device_os, software_version, uptime, serial_number) }
+	device_inventory = {}
 
 	# List of fields in network inventory report
 	network_inventory = []
@@ -145,32 +186,37 @@ if __name__ == '__main__':
 	# Read testbed filename
 	parser = argparse.ArgumentParser(description='testing pyATS')
 	parser.add_argument('testbed', type=str, help='pyATS testbed filename')
+	parser.add_argument('--workers', type=int, default=1, 
+		help='Number of devices to collect information from at the same time')
+	parser.add_argument('--devices', type=str, metavar='DEVICE_LIST', 
+		help='Only collect the devices in the hostname column of this CSV or XLSX file')
 	args = parser.parse_args()
 
 	# Load testbed file
 	print(f'Loading {args.testbed} file')
 	testbed = load(args.testbed)
 
-	# Connect to all devices, but silent logs
-	print(f'Connecting to all devices in {testbed.name}')
-	testbed.connect(log_stdout=False)
-
-	# testbed.devices = { hostname : <Device object> }
-	for device in testbed.devices.values():
-		# Run commands to gather information from network device
-		show_version[device.name] = parse_command(device,'show version')
-		# pprint(show_version)
-		show_inventory[device.name] = parse_command(device, 'show inventory')
-		# pprint(show_inventory)
-
-		# Build network inventory
-		#print(get_inventory(device, show_version, show_inventory))
-		network_inventory.append(get_inventory(device, show_version, show_inventory))
-		
-		# Disconnect from device
-		device.disconnect()
-		print(f'Disconnected successfully from {device.name}')
-
+	# Connect to many devices at once. A slow device only holds its own worker.
+	print(f'\nCollecting information from all devices in {testbed.name} ({args.workers} workers)')
+	with ThreadPoolExecutor(max_workers=args.workers) as executor:
+		# testbed.devices = { hostname : <Device object> }
+		futures = {
+			executor.submit(collect_device, device) : device 
+			for device in select_devices(testbed, args.devices)
+			}
+
+		for future in as_completed(futures):
+			device = futures[future]
+			try:
+				device_inventory[device.name] = future.result()
+			except Exception as e:
+				print(f'Error: Failed to collect information from {device.name}')
+				print(e)
+
+	# Keep the same order as the testbed file
+	for hostname in testbed.devices:
+		if device_inventory.get(hostname):
+			network_inventory.append(device_inventory[hostname])
 
 	# Network inventory output filename
 	now = datetime.now()
@@ -0,0 +1 @@
+../web03/device_broker.py
\ No newline at end of file
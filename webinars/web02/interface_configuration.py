@@ -7,90 +7,489 @@ Goal:
 	* Configure interface descriptions on IOS, IOS XE, NX-OS, and IOS XR devices.
 	* Save current description on interfaces for audit/change control.
 	* Check if devices are actually connected to the interfaces listed in CSV file.
+
+Changes are written to a plan file, a JSON document with the new configuration
+and the rollback to the current descriptions of every device. Only interfaces
+whose description differs from the rendered one are included. The plan is
+approved once and then pushed to many devices at the same time. Devices that
+fail are rolled back, and the result of every device is added to the plan.
+
+Usage
+	./interface_configuration.py --testbed TESTBED --sot SOT [--apply [--yes]] [--check]
+		[--plan PLAN_FILE] [--workers N] [--lldp-timeout SECONDS] [--lldp-workers N]
+		[--record ARCHIVE]
+	./interface_configuration.py --replay ARCHIVE --sot SOT [--apply] [--check]
+	./interface_configuration.py --broker SOCKET --sot SOT [--apply] [--check]
+
+	The SoT can be a CSV file or an XLSX workbook (requires openpyxl).
 """
 from pyats.topology.loader import load
-from jinja2 import Template
+from genie.metaparser.util.exceptions import SchemaEmptyParserError
+from genie.libs.parser.utils.common import ParserNotFound
+from replay import ReplayArchive, ReplayTestbed, RecordingTestbed
+from device_broker import BrokerTestbed
+from table_rows import iter_table_rows
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from jinja2 import Environment, FileSystemLoader
 from collections import defaultdict
+from functools import lru_cache
 from pprint import pprint
 from datetime import datetime
-from time import sleep
+from time import sleep, monotonic
+import json
 import csv
+import os
+import re
+
+# Command that lists every interface with its description, by device.os
+DESCRIPTION_COMMANDS = {
+	'nxos' : 'show interface description',
+	'iosxe' : 'show interfaces description',
+	'iosxr' : 'show interfaces description',
+	'ios' : 'show interfaces description'
+	}
+
+# Full name of the interface abbreviations used by each OS
+# IOS-XR names like TenGigE are mapped to the IOS names, so both compare equal
+INTERFACE_PREFIXES = {
+	'gi' : 'GigabitEthernet',
+	'gig' : 'GigabitEthernet',
+	'gigabitethernet' : 'GigabitEthernet',
+	'tw' : 'TwoGigabitEthernet',
+	'twogigabitethernet' : 'TwoGigabitEthernet',
+	'te' : 'TenGigabitEthernet',
+	'tengige' : 'TenGigabitEthernet',
+	'tengigabitethernet' : 'TenGigabitEthernet',
+	'twe' : 'TwentyFiveGigabitEthernet',
+	'twentyfivegige' : 'TwentyFiveGigabitEthernet',
+	'twentyfivegigabitethernet' : 'TwentyFiveGigabitEthernet',
+	'fo' : 'FortyGigabitEthernet',
+	'fortygige' : 'FortyGigabitEthernet',
+	'fortygigabitethernet' : 'FortyGigabitEthernet',
+	'hu' : 'HundredGigabitEthernet',
+	'hundredgige' : 'HundredGigabitEthernet',
+	'hundredgigabitethernet' : 'HundredGigabitEthernet',
+	'fa' : 'FastEthernet',
+	'fastethernet' : 'FastEthernet',
+	'et' : 'Ethernet',
+	'eth' : 'Ethernet',
+	'ethernet' : 'Ethernet',
+	'mgmteth' : 'MgmtEth',
+	'mgmt' : 'mgmt',
+	'lo' : 'Loopback',
+	'loopback' : 'Loopback',
+	'po' : 'Port-channel',
+	'port-channel' : 'Port-channel',
+	'be' : 'Bundle-Ether',
+	'bundle-ether' : 'Bundle-Ether',
+	'vl' : 'Vlan',
+	'vlan' : 'Vlan'
+	}
+
+INTERFACE_PATTERN = re.compile(r'^([A-Za-z-]+)\s*(.*)$')
+
+# Description line of a rendered configuration
+DESCRIPTION_PATTERN = re.compile(r'^\s*description (.*?)\s*$', re.MULTILINE)
+
+"""
+This function returns the full name of an interface, so the names of the
+SoT file and the devices can be compared.
+	'Gi0/1' -> 'GigabitEthernet0/1'
+	'Mgmt 0' -> 'mgmt0'
+	'TenGigE0/0/0/1' -> 'TenGigabitEthernet0/0/0/1'
+"""
+@lru_cache(maxsize=None)
+def normalize_interface(interface):
+	match = INTERFACE_PATTERN.match(interface.strip())
+	if not match:
+		return interface.strip()
+	prefix, number = match.groups()
+	return INTERFACE_PREFIXES.get(prefix.lower(), prefix) + number.replace(' ', '')
+
+"""
+This class reads the source of truth file once and shares it with every
+phase of the script. The file is streamed row by row, and the index and the
+report order share the same row dictionaries, so each row is stored once.
+	rows = [row, row, ...]  every row in file order, blank rows included, 
+	                        for the report
+	index = {device : {interface : row}}
+"""
+class SourceOfTruth:
+	def __init__(self, filename):
+		self.filename = filename
+		self.fieldnames = []
+		self.rows = []
+		self.index = {}
+
+		for row in iter_table_rows(filename):
+			if not self.fieldnames:
+				self.fieldnames = list(row.keys())
+			self.rows.append(row)
+			# Remove empty rows
+			if row['Device Name']:
+				self.index.setdefault(row['Device Name'], {})[row['Interface']] = row
+
+"""
+This function returns a compiled Jinja template. Templates are compiled
+once and kept in memory for the whole run.
+"""
+@lru_cache(maxsize=None)
+def get_template(filename):
+	environment = Environment(loader=FileSystemLoader(os.path.dirname(filename) or '.'))
+	return environment.get_template(os.path.basename(filename))
+
+"""
+This function renders the interface description commands of every row in
+the source of truth.
+	{device : {interface01 : 'config_commands', interface02 : config_commands ...}}
+"""
+def render_configs(sot, template_filename):
+	interface_template = get_template(template_filename)
+	devices_config = defaultdict(dict)
+	for device, interfaces in sot.index.items():
+		for interface, row in interfaces.items():
+			devices_config[device][interface] = interface_template.render(
+				interface_name = interface,
+				connected_device = row['Connected Device'],
+				connected_interface = row['Connected Interface'],
+				purpose = row['Purpose']
+				)
+	return devices_config
+
+"""
+This function returns the current description of every interface of a device.
+It only runs the description command of the device OS, instead of the full
+interface model, and falls back to learn('interface') for other platforms.
+	{normalized_interface : description}
+"""
+def learn_descriptions(device):
+	descriptions = {}
+	try:
+		output = device.parse(DESCRIPTION_COMMANDS[device.os])
+		interfaces = output['interfaces']
+	except SchemaEmptyParserError:
+		# No interfaces at all
+		interfaces = {}
+	except (KeyError, ParserNotFound):
+		interfaces = device.learn('interface').info
+
+	for interface, details in interfaces.items():
+		description = details.get('description', '').strip()
+		# NX-OS shows '--' for interfaces without a description
+		if description == '--':
+			description = ''
+		descriptions[normalize_interface(interface)] = description
+	return descriptions
+
+"""
+This function returns the short, lowercase name of a host, so LLDP system
+names can be compared with the SoT.
+	'core-rtr01.virl.info' -> 'core-rtr01'
+"""
+@lru_cache(maxsize=None)
+def normalize_hostname(hostname):
+	return hostname.strip().lower().split('.')[0]
+
+"""
+This class is the LLDP topology of the whole fabric: every link seen by
+every device, with normalized host and interface names.
+	{(host, interface) : {(neighbor_host, neighbor_interface), ...}}
+"""
+class LinkGraph:
+	def __init__(self):
+		self.links = defaultdict(set)
+		# Hosts whose LLDP neighbors are known
+		self.hosts = set()
+
+	"""
+	This method adds the output of 'show lldp neighbors detail' of a device.
+	"""
+	def add_lldp(self, device, lldp_output):
+		host = normalize_hostname(device)
+		self.hosts.add(host)
+		for interface, details in lldp_output.get('interfaces', {}).items():
+			local = (host, normalize_interface(interface))
+			for port_id, port in details.get('port_id', {}).items():
+				for neighbor in port.get('neighbors', {}):
+					self.links[local].add((normalize_hostname(neighbor), normalize_interface(port_id)))
+
+	"""
+	This method checks one SoT link, from both of its ends.
+		Correct - lldp neighbors match the sot file
+		Incorrect - lldp neighbors differ from the sot file
+		Unknown - lldp information is not available
+	"""
+	def check(self, device, interface, connected_device, connected_interface):
+		local = (normalize_hostname(device), normalize_interface(interface))
+		remote = (normalize_hostname(connected_device), normalize_interface(connected_interface))
+
+		seen_locally = remote in self.links.get(local, ())
+		seen_remotely = local in self.links.get(remote, ())
+
+		if seen_locally and (seen_remotely or remote[0] not in self.hosts):
+			return 'Correct'
+		if seen_locally:
+			return f'Correct - not confirmed by {connected_device}'
+		if seen_remotely:
+			return f'Correct - only seen by {connected_device}'
+
+		if local[0] not in self.hosts:
+			return 'Unknown - LLDP is not enabled'
+		if not self.links.get(local):
+			return 'Unknown - No LLDP neighbor info'
+		# Always report the same neighbor when there are many
+		neighbor_host, neighbor_interface = min(self.links[local])
+		return f'Incorrect - connected to {neighbor_host} {neighbor_interface}'
+
+"""
+This function reads the LLDP neighbors of a device. An empty table is
+returned when LLDP runs without neighbors, and None if it could not be read.
+"""
+def read_lldp(device):
+	try:
+		return device.parse('show lldp neighbors detail')
+	except SchemaEmptyParserError:
+		# LLDP runs, but there are no neighbors yet
+		return {'interfaces' : {}}
+	except Exception as e:
+		print(f'WARNING: Could not read lldp neighbors of {device.name}')
+		print(e)
+		return None
+
+"""
+This function enables LLDP on a device, unless its neighbor table shows it
+is already running.
+"""
+def enable_lldp(device):
+	lldp_output = read_lldp(device)
+	# Neighbors prove LLDP is already running
+	if lldp_output and lldp_output['interfaces']:
+		return
+
+	print(f'Enabling lldp on device {device.name}')
+	# Many errors can occurr while sending commands
+	try:
+		device.api.configure_lldp()
+	except Exception as e:
+		print(f'Error: Failed to enable lldp on {device.name}')
+		print(e)
+
+"""
+This function waits until the LLDP neighbors of a device converge, instead of
+sleeping a fixed time. The neighbor table is polled with exponential backoff
+until every expected SoT neighbor is seen or the 'deadline' (a monotonic()
+time shared by all devices) passes. The table is always read once, so
+devices polled late still get their result.
+	expected = [(interface, connected_device, connected_interface), ...]
+It returns the last 'show lldp neighbors detail' output, or None if the
+table could never be read.
+"""
+def poll_lldp(device, expected, deadline, first_delay=1, max_delay=8):
+	delay = first_delay
+	lldp_output = None
+
+	while True:
+		lldp_output = read_lldp(device) or lldp_output
+		if lldp_output:
+			links = LinkGraph()
+			links.add_lldp(device.name, lldp_output)
+			# Only this device is known, so a link seen from it is Correct
+			if all(links.check(device.name, *link) == 'Correct' for link in expected):
+				print(f'LLDP neighbors of {device.name} converged')
+				return lldp_output
+
+		if monotonic() + delay > deadline:
+			print(f'WARNING: LLDP neighbors of {device.name} did not converge in time')
+			return lldp_output
+		sleep(delay)
+		delay = min(delay * 2, max_delay)
+
+"""
+This function returns the commands that put back the old description of
+an interface.
+"""
+def rollback_config(interface, description):
+	if description:
+		return f'interface {interface}\n description {description}'
+	return f'interface {interface}\n no description'
+
+"""
+This function returns the description set by a rendered configuration.
+"""
+def rendered_description(configuration):
+	match = DESCRIPTION_PATTERN.search(configuration)
+	if match:
+		return match.group(1)
+	return ''
+
+"""
+This function builds the change plan: the new configuration of every device
+and the rollback to its current descriptions. Only the interfaces whose
+description changes are included, so devices that are already up to date
+get no configuration session at all. Devices whose descriptions could not
+be learned are skipped, and so are interfaces missing from the learned
+descriptions, they could not be rolled back.
+	plan = {device : {'config' : [stanza, ...], 'rollback' : [stanza, ...]}}
+	summary = {'changed' : N, 'unchanged' : N, 'skipped' : N}
+"""
+def build_plan(devices_config, interface_details):
+	plan = {}
+	summary = {'changed' : 0, 'unchanged' : 0, 'skipped' : 0}
+	for device, interfaces in devices_config.items():
+		if device not in interface_details:
+			print(f'WARNING: Skipping {device}, its current descriptions are unknown')
+			summary['skipped'] += len(interfaces)
+			continue
+
+		for interface, configuration in interfaces.items():
+			old_description = interface_details[device].get(normalize_interface(interface))
+			if old_description is None:
+				print(f'WARNING: Skipping {device} {interface}, its current description is unknown')
+				summary['skipped'] += 1
+				continue
+			if rendered_description(configuration) == old_description:
+				summary['unchanged'] += 1
+				continue
+
+			changes = plan.setdefault(device, {'config' : [], 'rollback' : []})
+			changes['config'].append(configuration)
+			changes['rollback'].append(rollback_config(interface, old_description))
+			summary['changed'] += 1
+	return plan, summary
+
+"""
+This function pushes the planned configuration to one device. If it fails,
+the old descriptions are configured back.
+	{'status' : 'applied' | 'rolled back' | 'rollback failed', 'error' : message}
+"""
+def push_device(device, changes):
+	print(f'Applying configurations to {device.name}')
+	# Many errors can ocurr when sending commands
+	try:
+		# Send all config commands at once
+		device.configure('\n'.join(changes['config']))
+		return {'status' : 'applied', 'error' : None}
+	except Exception as e:
+		print(f'Error: Configuration to {device.name} failed, rolling back')
+		print(e)
+		error = str(e)
+
+	try:
+		device.configure('\n'.join(changes['rollback']))
+		return {'status' : 'rolled back', 'error' : error}
+	except Exception as e:
+		print(f'Error: Rollback of {device.name} failed')
+		print(e)
+		return {'status' : 'rollback failed', 'error' : f'{error}; rollback: {e}'}
+
+"""
+This function writes the plan file.
+"""
+def write_plan(plan_filename, plan):
+	with open(plan_filename, 'w') as f:
+		json.dump(plan, f, indent=4)
 
 if __name__ == '__main__':
 	import argparse
 	
-	# Interface description commands
-	devices_config = defaultdict(dict)
-
-	# Output from learn interface model
+	# Current interface descriptions
+	# {device : {normalized_interface : description}}
 	interface_details = {}
 
 	# Read command line arguments
 	parser = argparse.ArgumentParser(
 		description='Updating interface descriptions')
 	parser.add_argument(
-		'--testbed', required=True, type=str, help='Testbed filename')
+		'--testbed', type=str, help='Testbed filename')
 	parser.add_argument(
-		'--sot', required= True, type=str, help='Source of truth filename')
+		'--sot', required= True, type=str, help='Source of truth filename (CSV or XLSX)')
 	parser.add_argument(
 		'--apply', action='store_true', help='If set, configurations are applied.')
+	parser.add_argument(
+		'--plan', type=str, metavar='PLAN_FILE', help='Write the change plan to this file')
+	parser.add_argument(
+		'--yes', action='store_true', help='Apply the plan without asking for approval')
 	parser.add_argument(
 		'--check', action='store_true', help='If set, compare lldp neighbors against the SoT file')
+	parser.add_argument(
+		'--workers', type=int, default=4, help='Number of devices to work on at the same time')
+	parser.add_argument(
+		'--lldp-timeout', type=int, default=30, help='Seconds to wait for lldp neighbors of all devices')
+	parser.add_argument(
+		'--lldp-workers', type=int, default=64, help='Number of devices to check lldp neighbors at the same time')
+	replay_group = parser.add_mutually_exclusive_group()
+	replay_group.add_argument(
+		'--record', type=str, metavar='ARCHIVE', help='Record every device interaction to this archive')
+	replay_group.add_argument(
+		'--replay', type=str, metavar='ARCHIVE', help='Run from a recorded archive, without network')
+	parser.add_argument(
+		'--broker', type=str, metavar='SOCKET', help='Use the warm device sessions of a device_broker.py process')
 	
 	args = parser.parse_args()
 
+	if not args.testbed and not args.replay and not args.broker:
+		parser.error('--testbed is required, unless --replay or --broker is used')
+	if args.broker and args.replay:
+		parser.error('--broker and --replay cannot be used together')
+
 	# Read the source of truth file
 	print(f'Reading {args.sot}')
-	with open(args.sot, newline='') as csvfile:
-		sot = csv.DictReader(csvfile)
-		
-		# Open configuration template
-		with open('config_template.j2') as f:
-			interface_template = Template(f.read())
-		
-		# Loop over each row in the source of truth file
-		for row in sot:
-			# Remove empty rows
-			if row['Device Name']:
-				# Create interface descriptions commands from the template
-				devices_config[row['Device Name']][row['Interface']] = \
-					interface_template.render(
-						interface_name = row['Interface'],
-						connected_device = row['Connected Device'],
-						connected_interface = row['Connected Interface'],
-						purpose = row['Purpose']
-						)
+	sot = SourceOfTruth(args.sot)
+
+	# Create interface descriptions commands from the template
+	devices_config = render_configs(sot, 'config_template.j2')
 
 	# Debuggin information
 	#print("Config commands generated")
 	#pprint(devices_config)
 	
 	# Load testbed file
-	print(f'Loading {args.testbed}')
-	testbed = load(args.testbed)
+	archive = None
+	if args.replay:
+		print(f'Replaying {args.replay}')
+		archive = ReplayArchive(args.replay)
+		testbed = ReplayTestbed(archive)
+	else:
+		if args.broker:
+			print(f'Using the device broker at {args.broker}')
+			testbed = BrokerTestbed(args.broker)
+		else:
+			print(f'Loading {args.testbed}')
+			testbed = load(args.testbed)
+
+		if args.record:
+			print(f'Recording to {args.record}')
+			archive = ReplayArchive(args.record, 'w')
+			testbed = RecordingTestbed(testbed, archive)
 
 	# Connect to all devices
 	print(f'Connecting to all devices in {testbed.name}')
 	testbed.connect(log_stdout=False)
 
 	# Grab current interface descriptions for devices in the SoT file
-	for device in devices_config.keys():
-		try:
-			print(f'Learning current interface configuration for device {device}')
-			interface_details[device] = testbed.devices[device].learn('interface')
-		except KeyError as e:
-			print(f'Error: Device {device} is not in the testbed')
+	with ThreadPoolExecutor(max_workers=args.workers) as executor:
+		futures = {}
+		for device in devices_config.keys():
+			if device in testbed.devices:
+				print(f'Learning current interface descriptions for device {device}')
+				futures[executor.submit(learn_descriptions, testbed.devices[device])] = device
+			else:
+				print(f'Error: Device {device} is not in the testbed')
+
+		for future in as_completed(futures):
+			device = futures[future]
+			try:
+				interface_details[device] = future.result()
+			except Exception as e:
+				print(f'Error: Failed to learn interface descriptions of {device}')
+				print(e)
 
 	# Debugging information
 	# Display current interface descriptions
-	# {device : <interface_object> }
 	#for device, interfaces in interface_details.items():
 	#	print(f'Current configuration for device {device}')
-	#	for interface, details in interfaces.info.items():
-	#		try:
-	#			print(f'Interface {interface} {details["description"]}')
-	#		except KeyError:
-	#			print(f'Interface {interface} does not have a description')
+	#	for interface, description in interfaces.items():
+	#		print(f'Interface {interface} {description}')
 	#	print('!\n')
 
 	# Display the config commands for the user to review
@@ -100,130 +499,120 @@ if __name__ == '__main__':
 		for interface, configuration in interfaces.items():
 			print(configuration)
 		print('!\n')
+	print('\n--------------------------------------')
+
+	if args.apply or args.plan:
+		plan_devices, summary = build_plan(devices_config, interface_details)
+		plan = {
+			'created' : datetime.now().isoformat(),
+			'testbed' : testbed.name,
+			'sot' : args.sot,
+			'summary' : summary,
+			'devices' : plan_devices
+			}
+		print(
+			f'Interfaces changed: {summary["changed"]}, unchanged: {summary["unchanged"]}, '
+			f'skipped: {summary["skipped"]}'
+			)
+
+		plan_filename = args.plan
+		if not plan_filename:
+			plan_filename = f'{datetime.now().strftime("%Y-%m-%d-%H-%M-%S")}_interface_config_plan.json'
+		print(f'Writing change plan to {plan_filename}')
+		write_plan(plan_filename, plan)
+
+	# Apply new interface descriptions
+	if args.apply and not plan['devices']:
+		print('All interface descriptions are up to date, nothing to apply')
+	elif args.apply:
+		# Confirm once if the user truly wants to apply the plan
+		confirm = 'y'
+		if not args.yes:
+			confirm = input(f'Do you want to apply {plan_filename} to {len(plan["devices"])} devices? (y/n) ')
+
+		if confirm == 'y':
+			plan['results'] = {}
+			with ThreadPoolExecutor(max_workers=args.workers) as executor:
+				futures = {}
+				for device, changes in plan['devices'].items():
+					if device in testbed.devices:
+						futures[executor.submit(push_device, testbed.devices[device], changes)] = device
+					else:
+						print(f'Error: Device {device} is not in the testbed')
+						plan['results'][device] = {'status' : 'skipped', 'error' : 'Not in the testbed'}
 
-		# Apply new interface descriptions
-		if args.apply:
-			# Confirm if the user truly wants to apply the configuration
-			confirm = input(f'Do you want to apply configuration to {device}? (y/n) ')
-			if confirm == 'y':
-				if device in testbed.devices:
-					print(f'Applying configurations to {device}')
-					# Many errors can ocurr when sending commands
-					try:
-						# Send all config commands at once
-						output = testbed.devices[device].configure(
-							'\n'.join(interfaces.values())
-							)
-						# Debugging information
-						# print(output)
-					except Exception as e:
-						print(f'Error: Configuration to {device} failed')
-						print(e)
-				else:
-					print(f'Error: Device {device} is not in the testbed')
-		print('\n--------------------------------------')
+				for future in as_completed(futures):
+					plan['results'][futures[future]] = future.result()
+
+			# Keep the results with the plan, for audit/change control
+			write_plan(plan_filename, plan)
+
+			print('\nConfiguration results')
+			for device, result in plan['results'].items():
+				print(f'{device}: {result["status"]}')
+
+	# Results of the lldp neighbor test
+	# {device : {interface : result}}
+	test_results = defaultdict(dict)
 
 	if args.check:
 		print('Checking lldp neighbors against the SoT file')
 		# Output from the show lldp neighbors detail parser
 		lldp_info = {}
 
-		# Enable lldp
 		# Only work with devices in the SoT file
-		
-		for device in devices_config:
+		# {device : [(interface, connected_device, connected_interface), ...]}
+		lldp_devices = {}
+		for device, interfaces in sot.index.items():
 			if device in testbed.devices:
-				print(f'Enabling lldp on device {device}')
-				# Many errors can occurr while sending commands
-				try:
-					testbed.devices[device].api.configure_lldp()
-				except Exception as e:
-					print(f'Error: Failed to enable lldp on {device}')
-					# Debugging information
-					print(e)
+				lldp_devices[device] = [
+					(interface, row['Connected Device'], row['Connected Interface'])
+					for interface, row in interfaces.items()
+					]
 			else:
 				print(f'Error: Device {device} is not in the testbed')
 
-		# Wait for neighbor relationships to form
-		print('\nWaiting for neighbor relationships to form...\n')
-		sleep(30)
-		
-		for device in devices_config:
-			if device in testbed.devices:
-				print(f'Learning lldp neighbors of device {device}')
-				
-				# Run cdp/lldp commands to grab neighbor information
+		# Polling mostly waits on the devices, so it has its own limit instead
+		# of sharing the --workers used to push configurations
+		lldp_workers = max(min(len(lldp_devices), args.lldp_workers), 1)
+		with ThreadPoolExecutor(max_workers=lldp_workers) as executor:
+			# Enable lldp where needed on every device before waiting on any
+			for future in [executor.submit(enable_lldp, testbed.devices[device]) for device in lldp_devices]:
+				future.result()
+
+			# Wait for neighbor relationships to form, all devices share one deadline
+			print('\nWaiting for neighbor relationships to form...\n')
+			deadline = monotonic() + args.lldp_timeout
+			futures = {
+				executor.submit(poll_lldp, testbed.devices[device], expected, deadline) : device
+				for device, expected in lldp_devices.items()
+				}
+
+			for future in as_completed(futures):
+				device = futures[future]
+				# Many errors can occurr while sending commands
 				try:
-					lldp_info[device] = testbed.devices[device].parse(
-						'show lldp neighbors detail')					
+					lldp_output = future.result()
+					if lldp_output is not None:
+						lldp_info[device] = lldp_output
 				except Exception as e:
 					print(f'Error: Failed to run lldp commands on {device}')
 					# Debugging information
 					print(e)
-			else:
-				print(f'Error: Device {device} is not in the testbed')
 		
-		# Debuggin information
-		# pprint(lldp_info)
-		# device :
-		# {
-		#	'interfaces' : 
-		#	{
-		#		interfaceX : 
-		#		{
-		#			'port-id' : 
-		#			{
-		#				portX : 
-		#				{
-		#					'neighbors' : 
-		#					{
-		#						hostnameX : {more_stuff}
-		#					}
-		#				}
-		#			}
-		#		}
-		#	}
-		# {
+		# Build the topology of the fabric
+		links = LinkGraph()
+		for device, lldp_output in lldp_info.items():
+			links.add_lldp(device, lldp_output)
 
 		# Check if devices are actually connected to the interfaces listed in CSV file.
-		# 	Correct - lldp neighbors match the sot file
-		# 	Incorrect - lldp neighbors differ from the sot file
-		# 	Unknown - lldp information is not available
-
-		test_results = defaultdict(dict)
-		with open(args.sot, newline='') as sot_file:
-			sot = csv.DictReader(sot_file)
-			for row in sot:
-				device = row['Device Name']
-				# Ignore blank rows and devices with no lldp entry
-				if device:
-					# Ignore devices without an lldp entry
-					if device in lldp_info.keys():
-						interface = row['Interface']
-						# Ignore interfaces that does not have neighbor relationships
-						if interface in lldp_info[device]['interfaces'].keys():
-							connected_device = row['Connected Device']
-							connected_interface = row['Connected Interface']
-							# Check if port_id matches information in the SoT
-							neighbor_interface = lldp_info[device]['interfaces'][interface]['port_id'].keys()
-							if connected_interface in neighbor_interface:
-								# Check if neighbor hostname matches information in the SoT
-								neighbor_hostname = lldp_info[device]['interfaces'][interface]['port_id'][connected_interface]['neighbors'].keys()
-								if  connected_device in neighbor_hostname:
-									test_results[device][interface] = 'Correct'
-								else:
-									# In some cases lldp neighbor_name differs from the SoT because
-									# neighbor_name = core-rtr01.virl.info 
-									# connected_device = core-rtr01
-									test_results[device][interface] = 'Incorrect - connected to ' + (list(neighbor_hostname)[0])
-							else:
-								test_results[device][interface] = 'Incorrect - connected to ' + (list(neighbor_interface)[0])
-						else:
-							print(f'WARNING: Device {device} {interface} does not have any neighbor relationships')
-							test_results[device][interface] = 'Unknown - No LLDP neighbor info'
-					else:
-						print(f'WARNING: LLDP is not enabled for device {device}')
-						test_results[device][row['Interface']] = 'Unknown - LLDP is not enabled'
+		for device, interfaces in sot.index.items():
+			for interface, row in interfaces.items():
+				test_results[device][interface] = links.check(
+					device, interface, row['Connected Device'], row['Connected Interface']
+					)
+				if test_results[device][interface].startswith('Unknown'):
+					print(f'WARNING: {device} {interface}: {test_results[device][interface]}')
 
 		# Debugging information
 		# pprint(test_results)
@@ -233,37 +622,39 @@ if __name__ == '__main__':
 		print(f'Disconnecting from {device.name}')
 		device.disconnect()
 
-	# Update source of truth file
-	with open(args.sot, newline='') as sot_file:
-		sot = csv.DictReader(sot_file)
+	if archive:
+		archive.close()
 
-		now = datetime.now()
-		report_filename = f'{now.strftime("%Y-%m-%d-%H-%M-%S")}_interface_config_report.csv'
+	# Update source of truth file
+	now = datetime.now()
+	report_filename = f'{now.strftime("%Y-%m-%d-%H-%M-%S")}_interface_config_report.csv'
 
-		# Create a list of field headers for the report
-		report_headers = sot.fieldnames + ['Old Description']
+	# Create a list of field headers for the report
+	report_headers = sot.fieldnames + ['Old Description']
 
-		# Add a new header for lldp neighbor test results
-		if args.check:
-			report_headers.append('LLDP neighbor test')
+	# Add a new header for lldp neighbor test results
+	if args.check:
+		report_headers.append('LLDP neighbor test')
 
-		# Open report file
-		print(f'Writing report to {report_filename}')
+	# Open report file
+	print(f'Writing report to {report_filename}')
 
-		with open(report_filename, 'w', newline='') as report_file:
-			writer = csv.DictWriter(report_file, fieldnames=report_headers)
+	with open(report_filename, 'w', newline='') as report_file:
+		writer = csv.DictWriter(report_file, fieldnames=report_headers)
 
-			writer.writeheader()
+		writer.writeheader()
 
-			# Read a line from SoT file
-			for line in sot:
-				try:
-					line['Old Description'] = \
-						interface_details[line['Device Name']].info[line['Interface']]['description']
-				except KeyError:
-					# Interface does not have a description
-					line['Old Description'] = ''
+		# Read a line from SoT file
+		for row in sot.rows:
+			line = dict(row)
+			try:
+				line['Old Description'] = \
+					interface_details[line['Device Name']][normalize_interface(line['Interface'])]
+			except KeyError:
+				# The description of the interface could not be learned
+				line['Old Description'] = ''
 
+			if args.check:
 				try:
 					line['LLDP neighbor test'] = \
 						test_results[line['Device Name']][line['Interface']]
@@ -271,5 +662,5 @@ if __name__ == '__main__':
 					# Empty line
 					line['LLDP neighbor test'] = ''
 
-				# Write that line, plus the new fields
-				writer.writerow(line)
+			# Write that line, plus the new fields
+			writer.writerow(line)
@@ -0,0 +1 @@
+../web03/replay.py
\ No newline at end of file
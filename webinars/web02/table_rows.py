@@ -0,0 +1 @@
+../web03/table_rows.py
\ No newline at end of file
@@ -0,0 +1,248 @@
+#!/usr/bin/env python
+
+"""
+This script measures how the inventory pipeline scales with the size of the
+network, without any real device.
+
+Goals
+	* Build synthetic testbeds with the five OS families handled by
+	  get_inventory (iosxr, iosxe, nxos, asa, ios).
+	* Simulate the latency of each command and the CPU cost of parsing it.
+	* Run parse_command -> get_inventory -> report writing with different
+	  numbers of workers and report formats.
+	* Report throughput, p50/p99 latency per device and peak memory as
+	  JSON Lines, one line per run, so runs can be compared.
+
+Usage
+	./benchmark_inventory.py --devices 10 1000 50000 --workers 1 16 64
+		[--latency SECONDS] [--parse-cost SECONDS] [--format csv jsonl]
+		[--output results.jsonl]
+"""
+
+from network_inventory import collect_device
+from replay import raise_recorded_error
+from inventory_sinks import make_sink, FILE_EXTENSIONS
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import redirect_stdout
+from datetime import datetime
+import tempfile
+import tracemalloc
+import resource
+import json
+import time
+import os
+
+OS_FAMILIES = ('iosxr', 'iosxe', 'nxos', 'asa', 'ios')
+
+"""
+This function returns the output that a device of each OS family gives for
+the commands run by the inventory. It follows the structures described in
+get_inventory. None means the command has no parser for that OS.
+"""
+def synthetic_output(os, command, serial):
+	uptime = '1 hour, 59 minutes'
+	if command == 'show version':
+		if os == 'iosxr':
+			return {'software_version' : '6.3.1', 'uptime' : uptime}
+		if os == 'iosxe':
+			return {'version' : {'chassis' : 'CSR1000V', 'version' : '16.11.1b', 'uptime' : uptime}}
+		if os == 'nxos':
+			return {'platform' : {
+				'software' : {'system_version' : '9.2(3)'},
+				'kernel_uptime' : {'days' : 0, 'hours' : 0, 'minutes' : 24, 'seconds' : 29}
+				}}
+		if os == 'ios':
+			return {'version' : {'version' : '15.2(CML', 'uptime' : uptime, 'chassis_sn' : serial}}
+		return None
+	if command == 'show inventory':
+		if os == 'iosxr':
+			return {'module_name' : {'0/0/CPU0' : {'sn' : serial}}}
+		if os == 'iosxe':
+			return {'main' : {'chassis' : {'CSR1000V' : {'sn' : serial}}}}
+		if os == 'nxos':
+			return {'name' : {'Chassis' : {'serial_number' : serial}}}
+		if os == 'asa':
+			return {'Chassis' : {'sn' : serial}}
+		return None
+	return None
+
+"""
+This class behaves like a connected pyATS device. Every command waits for
+'latency' seconds, like a telnet round trip, and parsing burns 'parse_cost'
+seconds of CPU, like a genie parser. Parsing an output that was already
+executed does not wait.
+"""
+class SimulatedDevice:
+	def __init__(self, name, os, latency, parse_cost):
+		self.name = name
+		self.os = os
+		self.latency = latency
+		self.parse_cost = parse_cost
+		self.serial = 'SN' + name.upper().replace('-', '')
+		self.connected = False
+
+	def __str__(self):
+		return self.name
+
+	def connect(self, **kwargs):
+		time.sleep(self.latency)
+		self.connected = True
+
+	def disconnect(self):
+		self.connected = False
+
+	def is_connected(self):
+		return self.connected
+
+	def execute(self, command, **kwargs):
+		# A list of commands is sent one by one, waiting for the prompt after
+		# each of them
+		if isinstance(command, list):
+			time.sleep(self.latency * len(command))
+			return {each : self.raw_output(each) for each in command}
+		time.sleep(self.latency)
+		return self.raw_output(command)
+
+	"""
+	These methods are the raw channel used to pipeline commands. All the
+	commands written at once are answered in a single round trip, each one
+	echoed after the prompt like a real CLI.
+	"""
+	def transmit(self, data):
+		self.pending = [command for command in data.split('\r') if command]
+
+	def receive(self, pattern, timeout=None):
+		time.sleep(self.latency)
+		return True
+
+	def receive_buffer(self):
+		lines = [f'{self.name}#{command}\r\n{self.raw_output(command)}\r\n' for command in self.pending]
+		return ''.join(lines) + f'{self.name}#'
+
+	def raw_output(self, command):
+		if self.os == 'asa' and command == 'show version':
+			return (
+				'Cisco Adaptive Security Appliance Software Version 9.12(2) \r\n'
+				'Device Manager Version 7.12(2)\r\n\r\n'
+				f'{self.name} up 2 hours 58 mins\r\n'
+				)
+		return ''
+
+	def parse(self, command, output=None, **kwargs):
+		result = synthetic_output(self.os, command, self.serial)
+		if result is None:
+			raise_recorded_error('ParserNotFound', f'{command} is not supported on {self.os}')
+
+		# Only a parse without output runs the command on the device
+		if output is None:
+			time.sleep(self.latency)
+		# Burn CPU like a parser does
+		deadline = time.perf_counter() + self.parse_cost
+		while time.perf_counter() < deadline:
+			pass
+		return result
+
+"""
+This function builds a testbed with the same number of devices of each
+OS family.
+"""
+def build_devices(size, latency, parse_cost):
+	return [
+		SimulatedDevice(f'sim-{i:05d}', OS_FAMILIES[i % len(OS_FAMILIES)], latency, parse_cost)
+		for i in range(size)
+		]
+
+"""
+This function returns the value below which 'percent' of the values fall.
+"""
+def percentile(values, percent):
+	if not values:
+		return None
+	values = sorted(values)
+	position = min(len(values) - 1, int(round(percent / 100 * (len(values) - 1))))
+	return values[position]
+
+"""
+This function times how long it takes to collect one device.
+"""
+def timed_collect(device):
+	start = time.perf_counter()
+	try:
+		record = collect_device(device)
+	except Exception:
+		record = None
+	return record, time.perf_counter() - start
+
+"""
+This function runs the inventory pipeline once and returns its measures.
+"""
+def run_benchmark(size, workers, latency, parse_cost, output_format='csv'):
+	devices = build_devices(size, latency, parse_cost)
+
+	tracemalloc.start()
+	start = time.perf_counter()
+
+	with tempfile.TemporaryDirectory() as directory:
+		inventory_filename = os.path.join(directory, f'inventory.{FILE_EXTENSIONS[output_format]}')
+		sink = make_sink(inventory_filename, output_format)
+		with open(os.devnull, 'w') as devnull, redirect_stdout(devnull):
+			latencies = []
+			errors = 0
+			with ThreadPoolExecutor(max_workers=workers) as executor:
+				for record, elapsed in executor.map(timed_collect, devices):
+					latencies.append(elapsed)
+					if record:
+						sink.write(record)
+					else:
+						errors += 1
+		sink.close()
+
+	elapsed = time.perf_counter() - start
+	current_memory, peak_memory = tracemalloc.get_traced_memory()
+	tracemalloc.stop()
+
+	return {
+		'timestamp' : datetime.now().isoformat(),
+		'devices' : size,
+		'workers' : workers,
+		'format' : output_format,
+		'latency' : latency,
+		'parse_cost' : parse_cost,
+		'errors' : errors,
+		'elapsed' : round(elapsed, 6),
+		'throughput' : round(size / elapsed, 3) if elapsed else None,
+		'p50_latency' : percentile(latencies, 50),
+		'p99_latency' : percentile(latencies, 99),
+		'peak_memory_bytes' : peak_memory,
+		'max_rss_kilobytes' : resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+		}
+
+# If run as a script
+if __name__ == '__main__':
+	import argparse
+
+	parser = argparse.ArgumentParser(description='Inventory pipeline benchmark')
+	parser.add_argument('--devices', type=int, nargs='+', default=[10, 100, 1000],
+		help='Testbed sizes to simulate (10 to 50000)')
+	parser.add_argument('--workers', type=int, nargs='+', default=[1, 16],
+		help='Number of workers to compare')
+	parser.add_argument('--latency', type=float, default=0.05,
+		help='Seconds each command waits for the device')
+	parser.add_argument('--parse-cost', type=float, default=0.001,
+		help='Seconds of CPU used to parse each command')
+	parser.add_argument('--format', type=str, nargs='+', default=['csv'],
+		choices=FILE_EXTENSIONS.keys(), help='Report formats to compare')
+	parser.add_argument('--output', type=str,
+		help='Append the results to this JSON Lines file')
+	args = parser.parse_args()
+
+	for size in args.devices:
+		for workers in args.workers:
+			for output_format in args.format:
+				result = run_benchmark(size, workers, args.latency, args.parse_cost, output_format)
+				line = json.dumps(result)
+				print(line)
+
+				if args.output:
+					with open(args.output, 'a') as f:
+						f.write(line + '\n')
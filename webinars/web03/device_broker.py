@@ -0,0 +1,283 @@
+#!/usr/bin/env python
+
+"""
+This script keeps authenticated pyATS device sessions warm and serves them
+to other scripts over a Unix socket, so short and frequent jobs do not pay
+the telnet login and terminal setup on every run.
+
+Goals
+	* Connect to a device the first time it is used and keep the session.
+	* Serve execute, parse, configure, learn and api requests.
+	* Disconnect devices that were not used for a while (idle eviction).
+	* Check idle sessions periodically and drop the ones that died, they
+	  are connected again on the next request (health checks).
+
+Protocol
+	One JSON object per line in each direction.
+	request:  {'op' : 'parse', 'device' : name, 'command' : command}
+	response: {'ok' : True, 'result' : output}
+	          {'ok' : False, 'error' : [exception_class, message]}
+
+web02 uses this same file through a symbolic link, so there is a single
+copy to change.
+
+Usage
+	# Start the broker
+	./device_broker.py --testbed nso_sandbox_testbed.yaml --socket /tmp/pyats.sock
+
+	# Use it from another script
+	testbed = BrokerTestbed('/tmp/pyats.sock')
+	testbed.devices['dist-rtr01'].parse('show version')
+"""
+
+from replay import raise_recorded_error
+from types import SimpleNamespace
+import socketserver
+import threading
+import socket
+import json
+import time
+import os
+
+"""
+This class keeps one session per device, with a lock so only one request
+at a time uses it.
+"""
+class SessionPool:
+	def __init__(self, testbed, idle_timeout=600):
+		self.testbed = testbed
+		self.idle_timeout = idle_timeout
+		self.locks = {name : threading.Lock() for name in testbed.devices}
+		self.last_used = {}
+
+	"""
+	This method runs a request on a device, connecting it first if needed.
+	"""
+	def run(self, request):
+		device = self.testbed.devices[request['device']]
+		op = request['op']
+
+		with self.locks[device.name]:
+			if not device.is_connected():
+				print(f'Connecting to {device.name}')
+				device.connect(log_stdout=False)
+			self.last_used[device.name] = time.time()
+
+			if op == 'connect':
+				return True
+			if op == 'execute':
+				return device.execute(request['command'])
+			if op == 'parse':
+				return device.parse(request['command'], **request.get('kwargs', {}))
+			if op == 'configure':
+				return device.configure(request['command'])
+			if op == 'learn':
+				# Ops objects are sent by their info dictionary
+				return device.learn(request['command']).info
+			if op == 'api':
+				function = getattr(device.api, request['command'])
+				return function(*request.get('args', []), **request.get('kwargs', {}))
+		raise ValueError(f'Unknown operation {op}')
+
+	"""
+	This method disconnects idle devices and checks the others still answer.
+	Busy devices are skipped, they are clearly alive.
+	"""
+	def check(self):
+		now = time.time()
+		for name, device in self.testbed.devices.items():
+			if not self.locks[name].acquire(blocking=False):
+				continue
+			try:
+				if not device.is_connected():
+					continue
+				if now - self.last_used.get(name, 0) > self.idle_timeout:
+					print(f'Disconnecting idle device {name}')
+					device.disconnect()
+					continue
+				try:
+					# An empty command only waits for the prompt
+					device.execute('')
+				except Exception as e:
+					print(f'Health check failed on {name}, dropping the session')
+					print(e)
+					try:
+						device.disconnect()
+					except Exception:
+						pass
+			finally:
+				self.locks[name].release()
+
+	def close(self):
+		for name, device in self.testbed.devices.items():
+			with self.locks[name]:
+				if device.is_connected():
+					print(f'Disconnecting from {name}')
+					device.disconnect()
+
+"""
+This class answers the requests of one client connection.
+"""
+class BrokerHandler(socketserver.StreamRequestHandler):
+	def handle(self):
+		pool = self.server.pool
+		for line in self.rfile:
+			request = json.loads(line)
+			try:
+				if request['op'] == 'devices':
+					result = {
+						'name' : pool.testbed.name,
+						'devices' : [
+							[name, device.os, getattr(device, 'platform', None)]
+							for name, device in pool.testbed.devices.items()
+							]
+						}
+				else:
+					result = pool.run(request)
+				response = {'ok' : True, 'result' : result}
+			except Exception as e:
+				response = {'ok' : False, 'error' : [type(e).__name__, str(e)]}
+
+			self.wfile.write((json.dumps(response, default=str) + '\n').encode())
+			self.wfile.flush()
+
+"""
+This class talks to the broker. Each thread uses its own socket, so many
+workers can send requests at the same time.
+"""
+class BrokerClient:
+	def __init__(self, socket_path):
+		self.socket_path = socket_path
+		self.local = threading.local()
+
+	def request(self, **request):
+		if not hasattr(self.local, 'file'):
+			connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+			connection.connect(self.socket_path)
+			self.local.file = connection.makefile('rwb')
+
+		self.local.file.write((json.dumps(request) + '\n').encode())
+		self.local.file.flush()
+		response = json.loads(self.local.file.readline())
+
+		if not response['ok']:
+			raise_recorded_error(*response['error'])
+		return response['result']
+
+"""
+This class sends the api calls of a device to the broker.
+"""
+class BrokerApi:
+	def __init__(self, device):
+		self.device = device
+
+	def __getattr__(self, name):
+		def call(*args, **kwargs):
+			return self.device.client.request(
+				op='api', device=self.device.name, command=name, args=args, kwargs=kwargs
+				)
+		return call
+
+"""
+This class behaves like a pyATS device, but the session lives in the broker.
+Disconnecting does nothing, so the session stays warm for the next run.
+"""
+class BrokerDevice:
+	def __init__(self, name, os, client, platform=None):
+		self.name = name
+		self.os = os
+		self.platform = platform
+		self.client = client
+		self.api = BrokerApi(self)
+
+	def __str__(self):
+		return self.name
+
+	def connect(self, **kwargs):
+		self.client.request(op='connect', device=self.name)
+
+	def disconnect(self):
+		pass
+
+	def is_connected(self):
+		# The broker connects the device when it is needed
+		return True
+
+	def execute(self, command, **kwargs):
+		return self.client.request(op='execute', device=self.name, command=command)
+
+	def parse(self, command, **kwargs):
+		return self.client.request(op='parse', device=self.name, command=command, kwargs=kwargs)
+
+	def configure(self, config, **kwargs):
+		return self.client.request(op='configure', device=self.name, command=config)
+
+	def learn(self, feature, **kwargs):
+		# Scripts only read the info attribute of Ops objects
+		return SimpleNamespace(info=self.client.request(op='learn', device=self.name, command=feature))
+
+"""
+This class behaves like a pyATS testbed whose devices live in the broker.
+"""
+class BrokerTestbed:
+	def __init__(self, socket_path):
+		self.client = BrokerClient(socket_path)
+		details = self.client.request(op='devices')
+		self.name = details['name']
+		self.devices = {
+			name : BrokerDevice(name, os, self.client, platform)
+			for name, os, platform in details['devices']
+			}
+
+	def connect(self, **kwargs):
+		# Sessions are opened by the broker on first use
+		pass
+
+# If run as a script
+if __name__ == '__main__':
+	from pyats.topology.loader import load
+	import argparse
+
+	parser = argparse.ArgumentParser(description='pyATS connection broker')
+	parser.add_argument('--testbed', required=True, type=str, help='pyATS testbed filename')
+	parser.add_argument('--socket', required=True, type=str, help='Unix socket path')
+	parser.add_argument('--idle-timeout', type=int, default=600,
+		help='Seconds before an unused session is disconnected')
+	parser.add_argument('--health-interval', type=int, default=60,
+		help='Seconds between health checks of the sessions')
+	args = parser.parse_args()
+
+	print(f'Loading {args.testbed}')
+	pool = SessionPool(load(args.testbed), args.idle_timeout)
+
+	# Remove the socket of a previous run
+	if os.path.exists(args.socket):
+		os.remove(args.socket)
+
+	# Only the owner can send commands to the devices, the socket is
+	# created with these permissions so it is never open to others
+	old_umask = os.umask(0o177)
+	try:
+		server = socketserver.ThreadingUnixStreamServer(args.socket, BrokerHandler)
+	finally:
+		os.umask(old_umask)
+	os.chmod(args.socket, 0o600)
+	server.daemon_threads = True
+	server.pool = pool
+
+	def health_checks():
+		while True:
+			time.sleep(args.health_interval)
+			pool.check()
+
+	threading.Thread(target=health_checks, daemon=True).start()
+
+	print(f'Serving {pool.testbed.name} on {args.socket}')
+	try:
+		server.serve_forever()
+	except KeyboardInterrupt:
+		print('Stopping broker')
+	finally:
+		server.server_close()
+		pool.close()
+		os.remove(args.socket)
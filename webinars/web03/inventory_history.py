@@ -0,0 +1,236 @@
+#!/usr/bin/env python
+
+"""
+This script keeps the history of every inventory report in a SQLite
+database, so questions across years of reports are answered with an
+indexed query instead of reading thousands of files.
+
+Goals
+	* Ingest the reports written by network_inventory.py (CSV, JSON Lines
+	  or Parquet). The run time and testbed are taken from the filename:
+		<YYYY-MM-DD-HH-MM-SS>_<testbed>_inventory.<extension>
+	* Store uptimes as integer seconds next to the original text.
+	* Index hostname, serial number, software version and run time.
+
+Usage
+	./inventory_history.py --db history.sqlite ingest <report> [<report> ...]
+	./inventory_history.py --db history.sqlite serial <serial_number>
+	./inventory_history.py --db history.sqlite version <software_version> [--since DATE] [--until DATE]
+	./inventory_history.py --db history.sqlite device <device_name>
+"""
+
+from inventory_sinks import read_records
+from datetime import datetime
+import sqlite3
+import os
+import re
+
+# Seconds in each time unit found in uptime strings
+UPTIME_UNITS = {
+	'year' : 365 * 86400,
+	'week' : 7 * 86400,
+	'day' : 86400,
+	'hour' : 3600,
+	'minute' : 60,
+	'min' : 60,
+	'second' : 1,
+	'sec' : 1
+	}
+UPTIME_PATTERN = re.compile(r'(\d+)\s*(year|week|day|hour|minute|min|second|sec)s?\b', re.IGNORECASE)
+
+REPORT_PATTERN = re.compile(r'^(\d{4}-\d{2}-\d{2}-\d{2}-\d{2}-\d{2})_(.+)_inventory\.\w+$')
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS runs (
+	id INTEGER PRIMARY KEY,
+	run_timestamp TEXT NOT NULL,
+	testbed TEXT,
+	source TEXT NOT NULL UNIQUE
+);
+CREATE TABLE IF NOT EXISTS inventory (
+	run_id INTEGER NOT NULL REFERENCES runs(id),
+	run_timestamp TEXT NOT NULL,
+	device_name TEXT NOT NULL,
+	device_os TEXT,
+	software_version TEXT,
+	uptime TEXT,
+	uptime_seconds INTEGER,
+	serial_number TEXT
+);
+CREATE INDEX IF NOT EXISTS runs_timestamp ON runs (run_timestamp);
+CREATE INDEX IF NOT EXISTS inventory_run ON inventory (run_id);
+CREATE INDEX IF NOT EXISTS inventory_device ON inventory (device_name, run_timestamp);
+CREATE INDEX IF NOT EXISTS inventory_serial ON inventory (serial_number, run_timestamp);
+CREATE INDEX IF NOT EXISTS inventory_version ON inventory (software_version, run_timestamp);
+'''
+
+"""
+This function converts an uptime string into seconds.
+	'00 days, 00 hours, 24 minutes' -> 1440
+	'1 hour, 59 minutes' -> 7140
+	'2 hours 58 mins' -> 10680
+It returns None if the string does not contain any time unit.
+"""
+def uptime_to_seconds(uptime):
+	matches = UPTIME_PATTERN.findall(uptime or '')
+	if not matches:
+		return None
+	return sum(int(value) * UPTIME_UNITS[unit.lower()] for value, unit in matches)
+
+"""
+This function returns the run time and testbed of a report, taken from its
+filename. Files with other names use their modification time.
+"""
+def report_details(filename):
+	match = REPORT_PATTERN.match(os.path.basename(filename.rstrip('/')))
+	if match:
+		run_time = datetime.strptime(match.group(1), '%Y-%m-%d-%H-%M-%S')
+		return run_time, match.group(2)
+	return datetime.fromtimestamp(os.path.getmtime(filename)), None
+
+"""
+This class stores inventory reports in a SQLite database and answers
+questions about them.
+"""
+class InventoryHistory:
+	def __init__(self, database):
+		self.connection = sqlite3.connect(database)
+		self.connection.row_factory = sqlite3.Row
+		self.connection.executescript(SCHEMA)
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *args):
+		self.close()
+
+	def close(self):
+		self.connection.close()
+
+	"""
+	This method adds one report to the database. Reports are identified by
+	their absolute path, so ingesting the same file twice does nothing.
+	It returns the number of records added.
+	"""
+	def ingest(self, filename):
+		source = os.path.abspath(filename)
+		run_time, testbed = report_details(filename)
+		run_timestamp = run_time.isoformat(sep=' ')
+
+		with self.connection:
+			cursor = self.connection.execute(
+				'INSERT OR IGNORE INTO runs (run_timestamp, testbed, source) VALUES (?, ?, ?)',
+				(run_timestamp, testbed, source)
+				)
+			if cursor.rowcount == 0:
+				print(f'{filename} is already in the history')
+				return 0
+			run_id = cursor.lastrowid
+
+			# Rows are read and inserted one at a time
+			rows = (
+				(
+					run_id,
+					run_timestamp,
+					record['device_name'],
+					record.get('device_os'),
+					record.get('software_version'),
+					record.get('uptime'),
+					uptime_to_seconds(record.get('uptime')),
+					record.get('serial_number')
+				)
+				for record in read_records(filename)
+				if record.get('device_name')
+				)
+			cursor = self.connection.executemany(
+				'INSERT INTO inventory VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+				rows
+				)
+			return cursor.rowcount
+
+	"""
+	This method returns the first and last time a serial number was seen,
+	and the devices that reported it.
+	"""
+	def serial_history(self, serial_number):
+		return self.connection.execute(
+			'''SELECT device_name, device_os, MIN(run_timestamp) AS first_seen, 
+				MAX(run_timestamp) AS last_seen, COUNT(*) AS runs
+			FROM inventory WHERE serial_number = ?
+			GROUP BY device_name, device_os ORDER BY first_seen''',
+			(serial_number,)
+			).fetchall()
+
+	"""
+	This method returns the devices that ran a software version between two
+	dates (ISO format), with the first and last run they were seen in.
+	"""
+	def version_history(self, software_version, since=None, until=None):
+		return self.connection.execute(
+			'''SELECT device_name, device_os, MIN(run_timestamp) AS first_seen, 
+				MAX(run_timestamp) AS last_seen, COUNT(*) AS runs
+			FROM inventory WHERE software_version = ? 
+				AND run_timestamp >= ? AND run_timestamp <= ?
+			GROUP BY device_name, device_os ORDER BY device_name''',
+			(software_version, since or '0000', until or '9999')
+			).fetchall()
+
+	"""
+	This method returns every record of a device, oldest first.
+	"""
+	def device_history(self, device_name):
+		return self.connection.execute(
+			'''SELECT run_timestamp, device_os, software_version, uptime, 
+				uptime_seconds, serial_number
+			FROM inventory WHERE device_name = ? ORDER BY run_timestamp''',
+			(device_name,)
+			).fetchall()
+
+"""
+This function prints query results as a small table.
+"""
+def print_rows(rows):
+	if not rows:
+		print('No records found')
+		return
+	print('\t'.join(rows[0].keys()))
+	for row in rows:
+		print('\t'.join('' if value is None else str(value) for value in row))
+
+# If run as a script
+if __name__ == '__main__':
+	import argparse
+
+	parser = argparse.ArgumentParser(description='Inventory history')
+	parser.add_argument('--db', required=True, type=str, help='SQLite database filename')
+	subparsers = parser.add_subparsers(dest='command', required=True)
+
+	ingest_parser = subparsers.add_parser('ingest', help='Add reports to the history')
+	ingest_parser.add_argument('reports', nargs='+', help='Inventory report filenames')
+
+	serial_parser = subparsers.add_parser('serial', help='When was a serial number seen')
+	serial_parser.add_argument('serial_number')
+
+	version_parser = subparsers.add_parser('version', help='Which devices ran a version')
+	version_parser.add_argument('software_version')
+	version_parser.add_argument('--since', type=str, help='First date, for example 2021-03-01')
+	version_parser.add_argument('--until', type=str, help='Last date, for example 2021-03-31')
+
+	device_parser = subparsers.add_parser('device', help='Every record of a device')
+	device_parser.add_argument('device_name')
+
+	args = parser.parse_args()
+
+	with InventoryHistory(args.db) as history:
+		if args.command == 'ingest':
+			for report in args.reports:
+				print(f'Adding {report}')
+				print(f'{history.ingest(report)} records added')
+		elif args.command == 'serial':
+			print_rows(history.serial_history(args.serial_number))
+		elif args.command == 'version':
+			# Dates without time include the whole last day
+			until = args.until + ' 99' if args.until and len(args.until) == 10 else args.until
+			print_rows(history.version_history(args.software_version, args.since, until))
+		elif args.command == 'device':
+			print_rows(history.device_history(args.device_name))
@@ -0,0 +1,264 @@
+"""
+This module writes inventory records as soon as they are produced, so a
+crash in the middle of a run does not lose the devices already collected.
+
+Formats
+	csv      The excel dialect CSV used by every inventory report.
+	jsonl    One JSON object per line.
+	parquet  A directory of Parquet files, one per flushed batch, that can
+	         be loaded as a single table (requires pyarrow).
+
+Every sink can resume an interrupted report: the devices already written
+are listed in 'written' and new records are appended after them. An existing
+report is never truncated when resuming, and report_format() tells which
+sink wrote it.
+
+Usage
+	sink = make_sink('inventory.csv', 'csv', resume=True)
+	for record in records:
+		sink.write(record)
+	sink.close()
+
+	for row in read_records('inventory.csv'):
+		print(row['device_name'])
+"""
+
+import json
+import csv
+import os
+
+# Optional dependency, only needed for the parquet format
+try:
+	import pyarrow
+	import pyarrow.parquet
+except ImportError:
+	pyarrow = None
+
+# collected_at is when the record was read, an ISO timestamp
+INVENTORY_FIELDS = ('device_name', 'device_os', 'software_version', 'uptime', 'serial_number', 'collected_at')
+
+FILE_EXTENSIONS = {
+	'csv' : 'csv',
+	'jsonl' : 'jsonl',
+	'parquet' : 'parquet'
+	}
+
+"""
+This function returns the format of a report from its file extension.
+"""
+def report_format(filename):
+	if filename.rstrip('/').endswith('.parquet'):
+		return 'parquet'
+	if filename.endswith('.jsonl'):
+		return 'jsonl'
+	return 'csv'
+
+"""
+This function removes an incomplete last line, left by a crash, so new
+records start on a clean line.
+"""
+def truncate_partial_line(filename):
+	with open(filename, 'rb+') as f:
+		data = f.read()
+		if data and not data.endswith(b'\n'):
+			f.truncate(data.rfind(b'\n') + 1)
+
+"""
+This class is the base of every sink. It keeps track of the devices in the
+report and flushes the output every 'flush_every' records.
+"""
+class InventorySink:
+	def __init__(self, filename, resume=False, flush_every=10):
+		self.filename = filename
+		self.flush_every = flush_every
+		self.pending = 0
+		# Names of the devices already in the report
+		self.written = set()
+		# An existing report is appended to, never overwritten
+		self.resuming = resume and os.path.exists(filename)
+
+		if self.resuming:
+			if os.path.isfile(filename):
+				truncate_partial_line(filename)
+			self.written = self.read_written()
+
+	"""
+	This method writes one record, unless its device is already in the report.
+	It returns True if the record was written.
+	"""
+	def write(self, record):
+		if not record or record[0] in self.written:
+			return False
+
+		self.write_record(record)
+		self.written.add(record[0])
+
+		self.pending += 1
+		if self.pending >= self.flush_every:
+			self.flush()
+		return True
+
+	def flush(self):
+		self.pending = 0
+
+	def close(self):
+		self.flush()
+
+"""
+This class writes the excel dialect CSV report.
+"""
+class CsvSink(InventorySink):
+	def __init__(self, filename, resume=False, flush_every=10):
+		super().__init__(filename, resume, flush_every)
+
+		if self.resuming and os.path.getsize(filename) > 0:
+			self.file = open(filename, 'a', newline='')
+			self.writer = csv.writer(self.file, dialect='excel')
+		else:
+			self.file = open(filename, 'w', newline='')
+			self.writer = csv.writer(self.file, dialect='excel')
+			self.writer.writerow(INVENTORY_FIELDS)
+
+	def read_written(self):
+		with open(self.filename, newline='') as f:
+			return {row['device_name'] for row in csv.DictReader(f) if row.get('device_name')}
+
+	def write_record(self, record):
+		self.writer.writerow(record)
+
+	def flush(self):
+		super().flush()
+		self.file.flush()
+
+	def close(self):
+		super().close()
+		self.file.close()
+
+"""
+This class writes one JSON object per line.
+"""
+class JsonLinesSink(InventorySink):
+	def __init__(self, filename, resume=False, flush_every=10):
+		super().__init__(filename, resume, flush_every)
+
+		if self.resuming:
+			self.file = open(filename, 'a')
+		else:
+			self.file = open(filename, 'w')
+
+	def read_written(self):
+		written = set()
+		with open(self.filename) as f:
+			for line in f:
+				try:
+					written.add(json.loads(line)['device_name'])
+				except (ValueError, KeyError):
+					# Incomplete line left by a crash
+					pass
+		return written
+
+	def write_record(self, record):
+		self.file.write(json.dumps(dict(zip(INVENTORY_FIELDS, record))) + '\n')
+
+	def flush(self):
+		super().flush()
+		self.file.flush()
+
+	def close(self):
+		super().close()
+		self.file.close()
+
+"""
+This class writes a Parquet dataset: a directory with one file per batch.
+A Parquet file is only readable once it is closed, so each flush closes a
+new part file and a crash loses, at most, one batch.
+"""
+class ParquetSink(InventorySink):
+	def __init__(self, filename, resume=False, flush_every=1000):
+		if pyarrow is None:
+			raise ImportError('The parquet format requires pyarrow (pip install pyarrow)')
+
+		self.schema = pyarrow.schema([(field, pyarrow.string()) for field in INVENTORY_FIELDS])
+		self.rows = []
+		super().__init__(filename, resume, flush_every)
+
+		if not self.resuming:
+			os.makedirs(filename, exist_ok=True)
+			for part in self.parts():
+				os.remove(os.path.join(filename, part))
+
+	def parts(self):
+		return sorted(
+			name for name in os.listdir(self.filename)
+			if name.startswith('part-') and name.endswith('.parquet')
+			)
+
+	def read_written(self):
+		written = set()
+		for part in self.parts():
+			path = os.path.join(self.filename, part)
+			try:
+				table = pyarrow.parquet.read_table(path, columns=['device_name'])
+			except Exception:
+				# Part file left open by a crash
+				os.remove(path)
+				continue
+			written.update(table.column('device_name').to_pylist())
+		return written
+
+	def write_record(self, record):
+		self.rows.append([None if value is None else str(value) for value in record])
+
+	def flush(self):
+		super().flush()
+		if not self.rows:
+			return
+
+		columns = list(zip(*self.rows))
+		table = pyarrow.Table.from_arrays(
+			[pyarrow.array(column, pyarrow.string()) for column in columns],
+			schema=self.schema
+			)
+		part = os.path.join(self.filename, f'part-{len(self.parts()):05d}.parquet')
+		# Write to a temporary name first, so readers never see half a file
+		pyarrow.parquet.write_table(table, part + '.tmp')
+		os.replace(part + '.tmp', part)
+		self.rows = []
+
+SINKS = {
+	'csv' : CsvSink,
+	'jsonl' : JsonLinesSink,
+	'parquet' : ParquetSink
+	}
+
+"""
+This function returns the sink for a report format.
+"""
+def make_sink(filename, output_format='csv', resume=False):
+	return SINKS[output_format](filename, resume)
+
+"""
+This function reads a report written by any sink, one row at a time.
+The format is taken from the file extension.
+	{'device_name' : name, 'device_os' : os, 'software_version' : version, ...}
+"""
+def read_records(filename):
+	output_format = report_format(filename)
+	if output_format == 'parquet':
+		if pyarrow is None:
+			raise ImportError('The parquet format requires pyarrow (pip install pyarrow)')
+		for part in sorted(os.listdir(filename)):
+			if part.startswith('part-') and part.endswith('.parquet'):
+				table = pyarrow.parquet.read_table(os.path.join(filename, part))
+				yield from table.to_pylist()
+	elif output_format == 'jsonl':
+		with open(filename) as f:
+			for line in f:
+				try:
+					yield json.loads(line)
+				except ValueError:
+					# Incomplete line left by a crash
+					continue
+	else:
+		with open(filename, newline='') as f:
+			yield from csv.DictReader(f)
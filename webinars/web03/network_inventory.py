@@ -10,20 +10,40 @@ Goals
 		- device name,
 		- software version,
 		- uptime,
-		- serial number.
+		- serial number,
+		- time the record was collected.
 
 Usage
-	./network_inventory </path/to/testbed_file>
+	./network_inventory </path/to/testbed_file> [--workers N]
+		[--aci-address ADDRESS] [--sdwan-address ADDRESS] [--session-cache FILE]
+		[--cache DIRECTORY [--cache-ttl SECONDS] [--cache-size N] [--refresh | --cache-only]]
+		[--incremental PREVIOUS_CSV] [--extractors JSON_FILE]
+		[--format csv|jsonl|parquet] [--resume REPORT] [--history DATABASE]
+		[--devices DEVICE_LIST] [--record ARCHIVE]
+	./network_inventory --replay ARCHIVE [options]
+	./network_inventory --broker SOCKET [options]
 """
 
 from pyats.topology.loader import load
 from genie.metaparser.util.exceptions import SchemaEmptyParserError
 from genie.libs.parser.utils.common import ParserNotFound
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
 from getpass import getpass
+from replay import ReplayArchive, ReplayTestbed, RecordingTestbed
+from device_broker import BrokerTestbed
+from inventory_sinks import make_sink, read_records, report_format, FILE_EXTENSIONS
+from table_rows import iter_table_rows
+from inventory_history import InventoryHistory, uptime_to_seconds
 from urllib3 import disable_warnings, exceptions
 import requests
-import csv
+import requests.adapters
+import threading
+import hashlib
+import json
+import time
+import os
+import re
 
 """
 Plan for SDN inventory
@@ -37,9 +57,11 @@ Plan for SDN inventory
 
 """
 This function authenticates to the ACI REST API.
+It returns the aaaLogin attributes, which include the token and the
+number of seconds it is valid (refreshTimeoutSeconds).
 If an error ocurrs, it returns False.
 """
-def auth_aci(aci_address, aci_username, aci_password):
+def auth_aci(aci_address, aci_username, aci_password, session=requests):
 	# Build URL
 	url = f'https://{aci_address}/api/aaaLogin.json'
 	# Build credentials dictionary
@@ -54,10 +76,10 @@ def auth_aci(aci_address, aci_username, aci_password):
 
 	# Make request
 	try:
-		reponse = requests.post(url, json=body, verify=False)
-		# Return token
+		reponse = session.post(url, json=body, verify=False)
+		# Return token details
 		if reponse.status_code == 200:
-			return reponse.json()['imdata'][0]['aaaLogin']['attributes']['token']
+			return reponse.json()['imdata'][0]['aaaLogin']['attributes']
 		else:
 			print('Bad request. Maybe wrong credentials.')
 	except Exception as e:
@@ -66,99 +88,267 @@ def auth_aci(aci_address, aci_username, aci_password):
 		return False
 
 """
-This function gathers information from the ACI to build a network 
-inventory report. If an error ocurrs, it returns False.
+This function extends the life of an ACI token without logging in again.
+The session must already carry the APIC-cookie.
+It returns the new aaaLogin attributes. If an error ocurrs, it returns False.
 """
-def get_aci_info(aci_address, aci_username, aci_password):
-	# Authenticate to the API
-	token = auth_aci(aci_address, aci_username, aci_password)
-	# Debugging information
-	#print(f'APIC-cookie={token}')
-	
-	# Error handling
-	if not token:
-		print(f'Unable to authenticate to {aci_address}')
+def refresh_aci(aci_address, session):
+	url = f'https://{aci_address}/api/aaaRefresh.json'
+	try:
+		response = session.get(url)
+		if response.status_code == 200:
+			return response.json()['imdata'][0]['aaaLogin']['attributes']
+		else:
+			print('Unable to refresh the ACI token')
+			return False
+	except Exception as e:
+		print('Unable to refresh the ACI token')
+		print(e)
+		return False
+
+"""
+This function logs out of the ACI REST API.
+It returns True if the session ended successfully. 
+If an error ocurred, it returns False
+"""
+def log_out_aci(aci_address, aci_username, session):
+	url = f'https://{aci_address}/api/aaaLogout.json'
+	body = {'aaaUser' : {'attributes' : {'name' : aci_username}}}
+	try:
+		response = session.post(url, json=body)
+		return response.status_code == 200
+	except Exception as e:
+		print('Error: Unable to log out of the ACI REST API')
+		print(e)
 		return False
 
-	cookies = {'APIC-cookie' : token}
+"""
+This function creates a requests session that keeps up to 'pool_size'
+connections alive, so API calls do not pay a new TCP and TLS handshake.
+With a replay archive, the session records or replays its HTTP calls.
+"""
+def make_session(pool_size, archive=None):
+	session = requests.Session()
+	session.verify = False
+	adapter = requests.adapters.HTTPAdapter(
+		pool_connections=1, 
+		pool_maxsize=pool_size
+		)
+	session.mount('https://', adapter)
+	if archive:
+		archive.mount(session)
+	return session
+
+"""
+This function sets a session cookie, replacing any cookie with the same name.
+Login responses already put their cookie in the jar, with the server domain,
+so setting it again would leave two copies and make cookies.get() fail.
+"""
+def set_cookie(session, name, value):
+	for cookie in list(session.cookies):
+		if cookie.name == name:
+			session.cookies.clear(cookie.domain, cookie.path, cookie.name)
+	session.cookies.set(name, value)
+
+"""
+This class keeps one authenticated session per controller for the whole run.
+The APIC token and the vManage JSESSIONID can be cached in a JSON file,
+together with their expiry time, so the next run reuses them:
+	* A cached APIC token is extended with aaaRefresh instead of a new login.
+	* A cached JSESSIONID is checked with a cheap API call before it is used.
+Credentials are only requested when a new login is needed.
+Without a cache file every session is logged out when close() is called.
+	{ 'aci:<address>' : {'token' : token, 'expires' : epoch}, 
+	  'sdwan:<address>' : {'cookie' : JSESSIONID, 'expires' : epoch} }
+"""
+class ControllerSessions:
+	# vManage does not report the session timeout, 30 minutes is the default
+	SDWAN_TIMEOUT = 1800
+	# Refresh tokens that are about to expire
+	MARGIN = 60
+
+	def __init__(self, cache_file=None, pool_size=3, archive=None):
+		self.cache_file = cache_file
+		self.pool_size = pool_size
+		self.archive = archive
+		self.cache = {}
+		# { key : (address, username, session, cookie) }
+		self.sessions = {}
+
+		if cache_file and os.path.exists(cache_file):
+			try:
+				with open(cache_file) as f:
+					self.cache = json.load(f)
+			except ValueError:
+				print(f'WARNING: Ignoring corrupted session cache {cache_file}')
+
+	"""
+	This method returns an authenticated session for an APIC.
+	'credentials' is a function that returns (username, password).
+	If an error ocurrs, it returns False.
+	"""
+	def aci(self, aci_address, credentials):
+		key = f'aci:{aci_address}'
+		if key in self.sessions:
+			return self.sessions[key][2]
+
+		session = make_session(self.pool_size, self.archive)
+		username = None
+		attributes = False
+
+		# Try to extend the cached token first
+		cached = self.cache.get(key)
+		if cached and cached['expires'] > time.time() + self.MARGIN:
+			set_cookie(session, 'APIC-cookie', cached['token'])
+			attributes = refresh_aci(aci_address, session)
+
+		if not attributes:
+			username, password = credentials()
+			attributes = auth_aci(aci_address, username, password, session)
+			if not attributes:
+				print(f'Unable to authenticate to {aci_address}')
+				return False
+
+		set_cookie(session, 'APIC-cookie', attributes['token'])
+		self.cache[key] = {
+			'token' : attributes['token'],
+			'expires' : time.time() + int(attributes['refreshTimeoutSeconds'])
+			}
+		self.sessions[key] = (aci_address, username, session, attributes['token'])
+		return session
+
+	"""
+	This method returns an authenticated session for a vManage.
+	'credentials' is a function that returns (username, password).
+	If an error ocurrs, it returns False.
+	"""
+	def sdwan(self, sdwan_address, credentials):
+		key = f'sdwan:{sdwan_address}'
+		if key in self.sessions:
+			return self.sessions[key][2]
+
+		session = make_session(self.pool_size, self.archive)
+		cookie = False
+
+		# Try the cached JSESSIONID first
+		cached = self.cache.get(key)
+		if cached and cached['expires'] > time.time() + self.MARGIN:
+			set_cookie(session, 'JSESSIONID', cached['cookie'])
+			if check_sdwan(sdwan_address, session):
+				cookie = cached['cookie']
+			else:
+				session.cookies.clear()
+
+		if not cookie:
+			username, password = credentials()
+			# The login response puts the JSESSIONID in the session
+			cookie = auth_sdwan(sdwan_address, username, password, session)
+			if not cookie:
+				print(f'Unable to authenticate to {sdwan_address}')
+				return False
+
+		# The cookie is kept here, it is never read back from the jar by name
+		self.sessions[key] = (sdwan_address, None, session, cookie)
+		return session
+
+	"""
+	This method ends the run. With a cache file the sessions are saved 
+	for the next run, otherwise they are logged out.
+	"""
+	def close(self):
+		for key, (address, username, session, cookie) in self.sessions.items():
+			if key.startswith('sdwan:'):
+				# Every API call resets the idle timer of the JSESSIONID
+				self.cache[key] = {
+					'cookie' : cookie,
+					'expires' : time.time() + self.SDWAN_TIMEOUT
+					}
+
+			if not self.cache_file:
+				if key.startswith('aci:') and username:
+					log_out_aci(address, username, session)
+				elif key.startswith('sdwan:'):
+					log_out_sdwan(address, cookie, session)
+			session.close()
+		self.sessions = {}
+
+		if self.cache_file:
+			# The cache holds secrets, only the owner can read it
+			with open(os.open(self.cache_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), 'w') as f:
+				json.dump(self.cache, f)
+
+"""
+This function returns the dn of the fabric node that owns an object.
+	'topology/pod-1/node-101/sys/fwstatuscont/running' -> 'topology/pod-1/node-101'
+"""
+def node_dn(dn):
+	return dn.split('/sys')[0]
+
+"""
+This function makes a class query to the ACI REST API and returns an index
+of the objects found: { node_dn : attributes }.
+If an error ocurrs, it returns False.
+"""
+def get_aci_class(session, aci_address, aci_class):
+	url = f'https://{aci_address}/api/node/class/{aci_class}.json'
+	response = session.get(url)
 
-	# Building URLs
-	fabric_url = f'https://{aci_address}/api/node/class/fabricNode.json'
-	firmware_url = 'https://{aci_address}/api/node/class/{node_dn}/firmwareRunning.json'
-	uptime_url = 'https://{aci_address}/api/node/class/{node_dn}/topSystem.json'
-	
-	# Make HTTP GET request	
-	fabricNode = requests.get(fabric_url, cookies=cookies, verify=False)
-	
 	# Debugging information
-	#print(f'fabricNode status: {fabricNode.status_code}')
-	#print(f'fabricNode body: {fabricNode.text}')
+	#print(f'{aci_class} status: {response.status_code}')
+	#print(f'{aci_class} body: {response.text}')
+
+	if response.status_code != 200:
+		print(f'Error: Failed to get {aci_class} information')
+		return False
+
+	index = {}
+	for item in response.json()['imdata']:
+		attributes = item[aci_class]['attributes']
+		index[node_dn(attributes['dn'])] = attributes
+	return index
+
+"""
+This function gathers information from the ACI to build a network 
+inventory report. Each class is fetched with a single query and the
+results are joined by node dn, so the number of API calls does not
+depend on the size of the fabric. 'session' must be authenticated 
+(see ControllerSessions). If an error ocurrs, it returns False.
+"""
+def get_aci_info(session, aci_address, workers=3):
+	# Make the three class queries at the same time
+	aci_classes = ('fabricNode', 'firmwareRunning', 'topSystem')
+	with ThreadPoolExecutor(max_workers=workers) as executor:
+		fabricNode, firmwareRunning, topSystem = executor.map(
+			lambda aci_class: get_aci_class(session, aci_address, aci_class), 
+			aci_classes
+			)
+
+	if fabricNode is False:
+		return False
 
 	# Proccess the data and return a list of tuples
 	inventory = []
-	software_version = ''
-	uptime = ''
+	for dn, node in fabricNode.items():
+		software_version = 'Unknown'
+		uptime = 'Unknown'
 
-	if fabricNode.status_code != 200:
-		print('Error: Failed to get fabricNode information')
-		return False
-	else:
-		# Loop over each node in the fabric
-		nodes = fabricNode.json()['imdata']
-		for node in nodes:
-			hostname = node['fabricNode']['attributes']['name']
-			model = node['fabricNode']['attributes']['model']
-			serial_number = node['fabricNode']['attributes']['serial']
-			dn = node['fabricNode']['attributes']['dn']
-
-			# Firmware
-			firmwareRunninng = requests.get(
-				firmware_url.format(aci_address=aci_address, node_dn=dn),
-				cookies = cookies,
-				verify = False
-				)
-			
-			# Debugging information
-			#print(f'firmwareRunning status: {firmwareRunninng.status_code}')
-			#print(f'firmwareRunning body: {firmwareRunninng.text}')
-			
-			if firmwareRunninng.status_code == 200:
-				if firmwareRunninng.json()['totalCount'] != '0':
-					software_version = firmwareRunninng.json()['imdata'][0]['firmwareRunning']['attributes']['version']
-				else:
-					software_version = 'Unknown'
-			else:
-				print(f'Error: Failed to get firmwareRunning information for {dn}')
-			
-			# Uptime
-			topSystem = requests.get(
-				uptime_url.format(aci_address=aci_address, node_dn=dn),
-				cookies = cookies,
-				verify = False
-				)
-
-			# Debugging information
-			#print(f'topSystem status: {topSystem.status_code}')
-			#print(f'topSystem body: {topSystem.text}')
-
-			if topSystem.status_code == 200:
-				if topSystem.json()['totalCount'] != '0':
-					uptime = topSystem.json()['imdata'][0]['topSystem']['attributes']['systemUpTime']
-					uptime = uptime.split(':')
-					uptime = f'{uptime[0]} days, {uptime[1]} hours, {uptime[2]} minutes'
-				else:
-					uptime = 'Unknown'
-			else:
-				print(f'Error: Failed to get topSystem information for {dn}')
+		# Firmware
+		if firmwareRunning and dn in firmwareRunning:
+			software_version = firmwareRunning[dn]['version']
+
+		# Uptime
+		if topSystem and dn in topSystem:
+			uptime = topSystem[dn]['systemUpTime'].split(':')
+			uptime = f'{uptime[0]} days, {uptime[1]} hours, {uptime[2]} minutes'
 
-			inventory.append( (hostname, f'apic-{model}', software_version, uptime, serial_number) )
-		return inventory
+		inventory.append( (node['name'], f'apic-{node["model"]}', software_version, uptime, node['serial']) )
+	return inventory
 
 """
 This function authenticates to the SD-WAN controller.
 If an error ocurrs, it returns False.
 """
-def auth_sdwan(sdwan_address, sdwan_username, sdwan_password):
+def auth_sdwan(sdwan_address, sdwan_username, sdwan_password, session=requests):
 	# Build URL
 	url = f'https://{sdwan_address}/j_security_check'
 
@@ -170,7 +360,7 @@ def auth_sdwan(sdwan_address, sdwan_username, sdwan_password):
 
 	# Make the post request
 	try:
-		reponse = requests.post(url, data=body, verify=False)
+		reponse = session.post(url, data=body, verify=False)
 		# Debugging information
 		#print(f'SD-WAN auth status: {reponse.status_code}')
 		#print(f'SD_WAN auth body: {reponse.text}')
@@ -183,13 +373,27 @@ def auth_sdwan(sdwan_address, sdwan_username, sdwan_password):
 	except Exception as e:
 		print('Error: Authentication to SD-WAN failed')
 		print(e)
+		return False
+
+"""
+This function checks if the session still has a valid JSESSIONID.
+vManage answers with the login page, instead of JSON, when it is not.
+"""
+def check_sdwan(sdwan_address, session):
+	url = f'https://{sdwan_address}/dataservice/client/server'
+	try:
+		response = session.get(url)
+		return response.status_code == 200 and \
+			response.headers.get('Content-Type', '').startswith('application/json')
+	except Exception:
+		return False
 
 """
 This function logs out of the SD-WAN controller API.
 It returns True if the session ended successfully. 
 If an error ocurred, it returns False
 """
-def log_out_sdwan(sdwan_address, cookie):
+def log_out_sdwan(sdwan_address, cookie, session=requests):
 	# Build URL
 	url = f'https://{sdwan_address}/logout'
 
@@ -198,7 +402,7 @@ def log_out_sdwan(sdwan_address, cookie):
 
 	# Make the get request
 	try:
-		response = requests.get(url, cookies=cookies, verify=False)
+		response = session.get(url, cookies=cookies, verify=False)
 
 		if response.status_code == 200:
 			return True
@@ -211,37 +415,85 @@ def log_out_sdwan(sdwan_address, cookie):
 		return False
 
 """
-This function gathers information from the SD-WAN to build a network 
-inventory report. If an error ocurrs, it returns False.
+This function reads a JSON document in chunks and yields the items of the
+array stored under 'key', one at a time, as soon as each item is complete.
+The whole document is never held in memory. It raises ValueError if the
+document has no such array, for example an HTML error page.
+	{"header": {...}, "data": [ {item}, {item}, ... ]}
 """
-def get_sdwan_info(sdwan_address, sdwan_username, sdwan_password):
-	# Authenticate to the API
-	cookie = auth_sdwan(sdwan_address, sdwan_username, sdwan_password)
-	# Debugging information
-	#print(f'JSESSIONID: {cookie}')
+def iter_json_array(chunks, key):
+	decoder = json.JSONDecoder()
+	quoted_key = f'"{key}"'
+	start_pattern = re.compile(r'{key}\s*:\s*\['.format(key=re.escape(quoted_key)))
+	# What can follow the key while the '[' has not arrived yet
+	partial_pattern = re.compile(r'\s*(?::\s*)?')
+	chunks = iter(chunks)
+	buffer = ''
 
-	if cookie:
-		# Make cookies dictionary
-		cookies = {'JSESSIONID' : cookie}
+	# Look for the beginning of the array
+	while True:
+		match = start_pattern.search(buffer)
+		if match:
+			buffer = buffer[match.end():]
+			break
+		chunk = next(chunks, None)
+		if chunk is None:
+			raise ValueError(f'The document has no "{key}" array')
+		# Only keep what can still be the start of the array: the key and
+		# the whitespace after it, or the beginning of the key
+		position = buffer.rfind(quoted_key)
+		if position < 0 or not partial_pattern.fullmatch(buffer, position + len(quoted_key)):
+			position = buffer.rfind('"')
+			if position >= 0 and not quoted_key.startswith(buffer[position:]):
+				position = -1
+		buffer = (buffer[position:] if position >= 0 else '') + chunk
 
-		# Make headers dictionary
-		headers = {'Content-Type' : 'application/json'}
+	# Decode one item at a time
+	while True:
+		buffer = buffer.lstrip(' \t\r\n,')
+		if buffer.startswith(']'):
+			return
+		try:
+			item, end = decoder.raw_decode(buffer)
+		except ValueError:
+			# The item is not complete yet
+			chunk = next(chunks, None)
+			if chunk is None:
+				if buffer:
+					raise
+				return
+			buffer += chunk
+			continue
+		buffer = buffer[end:]
+		yield item
 
-		# Make HTTP GET requests
-		url = f'https://{sdwan_address}/dataservice/device'
-		response = requests.get(url, headers=headers, cookies=cookies, verify=False)
-		# Debugging information
-		#print(f'SD-WAN response status: {response.status_code}')
-		#print(f'SD-WAN response body: {response.text}')
+"""
+This function gathers information from the SD-WAN to build a network 
+inventory report. The device list is parsed while it is downloaded and
+the tuples are yielded one at a time, so memory does not grow with the
+number of devices. 'session' must be authenticated (see ControllerSessions).
+If an error ocurrs, it prints it and stops yielding.
+"""
+def get_sdwan_info(session, sdwan_address):
+	# Make headers dictionary
+	headers = {'Content-Type' : 'application/json'}
 
-		# Log out of the SD-WAN controller API
-		# Debugging information
-		#print('Logging out of the SD-WAN controller API')
-		#print(log_out_sdwan(sdwan_address, cookie))
+	# Make HTTP GET requests, but do not download the body yet
+	url = f'https://{sdwan_address}/dataservice/device'
+	response = session.get(url, headers=headers, stream=True)
+	# Debugging information
+	#print(f'SD-WAN response status: {response.status_code}')
 
-		# Process the data and return a list of tuples
-		inventory = []
-		for device in response.json()['data']:
+	if response.status_code != 200:
+		print('Error: Failed to get SD-WAN device information')
+		response.close()
+		return
+
+	# Process the data and yield tuples as they arrive
+	response.encoding = response.encoding or 'utf-8'
+	chunks = response.iter_content(chunk_size=65536, decode_unicode=True)
+	try:
+		for device in iter_json_array(chunks, 'data'):
 			hostname = device['host-name']
 			model = device['device-model']
 			software_version = device['version']
@@ -261,42 +513,243 @@ def get_sdwan_info(sdwan_address, sdwan_username, sdwan_password):
 			uptime = f'{days} days, {hours} hours, {minutes} minutes'
 
 			serial_number = device['board-serial']
-			inventory.append( (hostname, model, software_version, uptime, serial_number) )
-		return inventory
-	else:
-		return False
-	
+			yield (hostname, model, software_version, uptime, serial_number)
+	except ValueError as e:
+		print('Error: Failed to read SD-WAN device information')
+		print(e)
+	finally:
+		response.close()
 
 """
-This function is used to look for information between two substrings
-It only returns the first coincidence inside another string called 'text'.
+This function asks the user for the credentials of a controller.
 """
-def search_between(lstring, rstring, text):
-    start_position = text.index(lstring)
-    end_position = text.find(rstring, start_position)
-    return text[start_position + len(lstring): end_position]
+def ask_credentials(address):
+	username = input(f'What is the username for {address}? ')
+	password = getpass(f'Enter the password (input will be hidden): ')
+	return username, password
+
+"""
+This class stores the result of parse_command on disk, so a device that 
+was already collected is not polled again. There is one JSON file per
+(device, os, command):
+	{ 'timestamp' : epoch, 'device' : name, 'os' : os, 'command' : command,
+	  'type' : 'parsed' | 'raw', 'output' : output }
+Entries older than 'ttl' seconds are ignored. prune() deletes them and 
+keeps only the 'max_entries' most recently used files.
+	mode = 'normal'   use the cache and store new results
+	mode = 'refresh'  always run the command and store the new result
+	mode = 'only'     never run commands, a missing entry is an error
+"""
+class ParseCache:
+	def __init__(self, directory, ttl=86400, max_entries=10000, mode='normal'):
+		self.directory = directory
+		self.ttl = ttl
+		self.max_entries = max_entries
+		self.mode = mode
+		self.lock = threading.Lock()
+		os.makedirs(directory, exist_ok=True)
+
+	def path(self, device, command):
+		key = f'{device.name}|{device.os}|{command}'.encode()
+		return os.path.join(self.directory, hashlib.sha1(key).hexdigest() + '.json')
+
+	"""
+	This method returns the cached result, or None if it is missing or expired.
+	"""
+	def get(self, device, command):
+		if self.mode == 'refresh':
+			return None
+
+		path = self.path(device, command)
+		try:
+			with open(path) as f:
+				entry = json.load(f)
+		except (OSError, ValueError):
+			return None
+
+		if entry['timestamp'] + self.ttl < time.time():
+			return None
+
+		# Mark the entry as recently used
+		os.utime(path)
+		return {'type' : entry['type'], 'output' : entry['output']}
+
+	def put(self, device, command, result):
+		entry = {
+			'timestamp' : time.time(),
+			'device' : device.name,
+			'os' : device.os,
+			'command' : command,
+			'type' : result['type'],
+			'output' : result['output']
+			}
+		path = self.path(device, command)
+		# Write to a temporary file first, so readers never see half an entry
+		temp_path = f'{path}.{threading.get_ident()}.tmp'
+		with open(temp_path, 'w') as f:
+			json.dump(entry, f, default=str)
+		os.replace(temp_path, path)
+
+	"""
+	This method deletes expired entries and the least recently used ones
+	above 'max_entries'.
+	"""
+	def prune(self):
+		with self.lock:
+			entries = []
+			for entry in os.scandir(self.directory):
+				if entry.name.endswith('.json'):
+					entries.append((entry.stat().st_mtime, entry.path))
+			entries.sort(reverse=True)
+
+			expired = time.time() - self.ttl
+			for position, (mtime, path) in enumerate(entries):
+				if position >= self.max_entries or mtime < expired:
+					os.remove(path)
+
+# OSes whose CLI echoes each command after a '<hostname>#' prompt, so the
+# outputs of pipelined commands can be split on those echoes
+PIPELINE_OSES = {'ios', 'iosxe', 'iosxr', 'nxos'}
+
+# Prompt at the start of a line, 'dist-rtr01#' or 'RP/0/RP0/CPU0:core-rtr01#'
+PROMPT_PATTERN = r'[^\r\n#]*#[ \t]*'
+
+"""
+This function sends several commands to a device in a single write and reads
+all their outputs in one channel interaction, so the commands cost one round
+trip instead of one each. The device echoes every command after its prompt,
+which is where the output of the previous command ends. It raises an error
+if the outputs can not be split reliably.
+	{command : output}
+"""
+def pipeline_execute(device, commands, timeout=60):
+	echoes = [
+		re.compile(rf'^(?:{PROMPT_PATTERN})?{re.escape(command)}[ \t]*\r?$', re.MULTILINE)
+		for command in commands
+		]
+
+	device.transmit(''.join(f'{command}\r' for command in commands))
+	# Wait for the prompt that follows the output of the last command
+	last_echo = rf'{PROMPT_PATTERN}{re.escape(commands[-1])}[\s\S]*\n{PROMPT_PATTERN}$'
+	if not device.receive(last_echo, timeout=timeout):
+		raise TimeoutError(f'Pipelined commands did not complete on {device.name}')
+	buffer = device.receive_buffer()
+
+	# Find the echo of every command, in order
+	matches = []
+	position = 0
+	for command, echo in zip(commands, echoes):
+		match = echo.search(buffer, position)
+		if not match:
+			raise ValueError(f'Could not find the output of {command} on {device.name}')
+		matches.append(match)
+		position = match.end()
+
+	# The output of the last command ends at the final prompt
+	ends = [match.start() for match in matches[1:]]
+	ends.append(buffer.rstrip().rfind('\n') + 1)
+	return {
+		command : buffer[match.end():end].strip('\r\n')
+		for command, match, end in zip(commands, matches, ends)
+		}
+
+"""
+This function runs several commands on a device and returns their outputs.
+Devices with a known prompt get the commands pipelined in one round trip,
+anything else (or a pipeline that fails) runs them with device.execute,
+which waits for the prompt after each command.
+	{command : output}
+"""
+def execute_commands(device, commands):
+	if len(commands) > 1 and device.os in PIPELINE_OSES and hasattr(device, 'transmit'):
+		try:
+			return pipeline_execute(device, commands)
+		except Exception as e:
+			print(f'WARNING: Could not pipeline commands on {device.name}, running them one by one')
+			print(e)
+
+	outputs = device.execute(commands)
+	# A list with a single command returns its output, not a dictionary
+	if not isinstance(outputs, dict):
+		outputs = {commands[0] : outputs}
+	return outputs
 
 """
 This fuction tries to parse a command on a device, but
-returns raw output in case the command is not supported
+returns raw output in case the command is not supported.
+If a ParseCache is given, a fresh cached result is returned instead and
+the device is only connected when the command really has to run.
 """
-def parse_command(device, command):
-	print(f'Running {command} on {device.name}')
-	try:
-		output = device.parse(command)
-		return {'type': 'parsed', 'output': output}
-	except SchemaEmptyParserError:
-		print(f'WARNING: Parsed {command}, but it returned empty')
-	except ParserNotFound:
-		print(f'WARNING: Parser for {command} is not supported in {device}')
+def parse_command(device, command, cache=None):
+	return parse_commands(device, [command], cache)[command]
 
-	# Execute the command anyway, but return raw output
-	output = device.execute(command)
-	return {'type': 'raw', 'output': output}
+"""
+This function runs several commands on a device and parses each output.
+The commands run in one round trip where the device allows it (see
+execute_commands). Each output is then given to its parser, and kept raw if
+no parser supports it, without executing the command again.
+	{command : {'type' : 'parsed' | 'raw', 'output' : output}}
+"""
+def parse_commands(device, commands, cache=None):
+	results = {}
+	if cache:
+		for command in commands:
+			result = cache.get(device, command)
+			if result:
+				print(f'Using cached {command} for {device.name}')
+				results[command] = result
+			elif cache.mode == 'only':
+				raise LookupError(f'{command} for {device.name} is not in the cache')
+
+	missing = [command for command in commands if command not in results]
+	if not missing:
+		return results
+
+	if not device.is_connected():
+		# Connect to the device, but silent logs
+		device.connect(log_stdout=False)
+
+	print(f'Running {", ".join(missing)} on {device.name}')
+	outputs = execute_commands(device, missing)
+
+	for command in missing:
+		try:
+			output = device.parse(command, output=outputs[command])
+			result = {'type': 'parsed', 'output': output}
+		except SchemaEmptyParserError:
+			print(f'WARNING: Parsed {command}, but it returned empty')
+			result = {'type': 'raw', 'output': outputs[command]}
+		except ParserNotFound:
+			print(f'WARNING: Parser for {command} is not supported in {device}')
+			result = {'type': 'raw', 'output': outputs[command]}
+
+		if cache:
+			cache.put(device, command, result)
+		results[command] = result
+	return results
 
 """
-This function process device-specific information and 
-returns standardized output
+Extractor specs: how the inventory fields are found for each device.os.
+A spec keyed '<os>-<platform>', like 'nxos-aci' or 'iosxe-sdwan', is used
+instead of the one of its OS for devices with that platform in the testbed.
+Each field has a list of sources, tried in order until one returns a value:
+	{'source' : 'show_version' | 'show_inventory', 'path' : [key, key, ...]}
+		Nested keys in the parsed output. '{field}' in a key is replaced by 
+		a field extracted before, for example '{model}'.
+	{'source' : ..., 'pattern' : regex}
+		The (?P<value>...) group of a regular expression on the raw output.
+		All the patterns of a command are matched in a single pass.
+	{..., 'format' : '{days} days, {hours} hours'}
+		Formats a dictionary value.
+When a command only returned raw output, fields that are still missing
+are taken from RAW_SHOW_VERSION_PATTERNS, which work on most Cisco OSes.
+A field without any value is reported as 'N/A'. Every spec must have the
+REQUIRED_FIELDS of the report. Fields that are not part of the report, like
+'model', can be used by the next ones.
+
+New platforms are added with register_extractor(), or with a JSON file of
+the same format (--extractors), without changing get_inventory.
+
 	IOS XR
 	# software version: show_version[hostname][output][software_version]
 	#	'6.3.1'
@@ -339,147 +792,539 @@ returns standardized output
 	# show_version[hostname][output][version][chassis_sn]
 	#	'99GVDCAYZ1T'
 """
+INVENTORY_EXTRACTORS = {
+	'iosxr' : {
+		'software_version' : [{'source' : 'show_version', 'path' : ['software_version']}],
+		'uptime' : [{'source' : 'show_version', 'path' : ['uptime']}],
+		# show_inventory is empty
+		'serial_number' : [{'source' : 'show_inventory', 'path' : ['module_name', '0/0/CPU0', 'sn']}]
+		},
+	'iosxe' : {
+		'model' : [{'source' : 'show_version', 'path' : ['version', 'chassis']}],
+		'software_version' : [{'source' : 'show_version', 'path' : ['version', 'version']}],
+		'uptime' : [{'source' : 'show_version', 'path' : ['version', 'uptime']}],
+		# show_inventory is empty
+		'serial_number' : [{'source' : 'show_inventory', 'path' : ['main', 'chassis', '{model}', 'sn']}]
+		},
+	'nxos' : {
+		'software_version' : [{'source' : 'show_version', 'path' : ['platform', 'software', 'system_version']}],
+		'uptime' : [{
+			'source' : 'show_version', 
+			'path' : ['platform', 'kernel_uptime'], 
+			'format' : '{days} days, {hours} hours, {minutes} minutes'
+			}],
+		'serial_number' : [{'source' : 'show_inventory', 'path' : ['name', 'Chassis', 'serial_number']}]
+		},
+	'asa' : {
+		'software_version' : [{'source' : 'show_version', 'pattern' : r'Software Version (?P<value>.*?)\r?$'}],
+		'uptime' : [{'source' : 'show_version', 'pattern' : r'^\S+ up (?P<value>.*?)\r?$'}],
+		'serial_number' : [{'source' : 'show_inventory', 'path' : ['Chassis', 'sn']}]
+		},
+	'ios' : {
+		'software_version' : [{'source' : 'show_version', 'path' : ['version', 'version']}],
+		'uptime' : [{'source' : 'show_version', 'path' : ['version', 'uptime']}],
+		'serial_number' : [{'source' : 'show_version', 'path' : ['version', 'chassis_sn']}]
+		}
+	}
+
+# Fields found in the raw output of 'show version' on most Cisco OSes
+RAW_SHOW_VERSION_PATTERNS = [
+	('software_version', r'Software Version (?P<value>.*?)\r?$'),
+	('software_version', r'(?:NXOS|system):\s+version (?P<value>\S+)'),
+	('software_version', r'Software.*?, Version (?P<value>[^\s,\[]+)'),
+	('uptime', r'uptime is (?P<value>.*?)\r?$'),
+	('uptime', r'^\S+ up (?P<value>.*?)\r?$'),
+	('model', r'^Hardware:\s+(?P<value>[^,\r\n]+)'),
+	('model', r'^[Cc]isco (?P<value>\S+) .*?processor'),
+	('serial_number', r'Processor [Bb]oard ID (?P<value>\S+)'),
+	('serial_number', r'^Serial Number:\s+(?P<value>\S+)')
+	]
+
+"""
+This class finds several fields in a raw command output with one scan.
+Every pattern has a single (?P<value>...) group and they are all joined in
+one compiled regular expression. The text is read once, the first match of
+each field is kept and the scan stops when every field has been found.
+Missing fields are returned as None. A pattern with any other capturing
+group is rejected, use (?:...) for grouping.
+	RawTextExtractor([('uptime', r'uptime is (?P<value>.*?)$'), ...])
+"""
+class RawTextExtractor:
+	def __init__(self, patterns):
+		self.fields = []
+		# { group_name : field }
+		self.group_fields = {}
+		alternatives = []
+		for position, (field, pattern) in enumerate(patterns):
+			compiled = re.compile(pattern)
+			if compiled.groups != 1 or 'value' not in compiled.groupindex:
+				raise ValueError(f'The pattern of {field} must have exactly one capturing group, (?P<value>...): {pattern}')
+			group = f'p{position}'
+			self.group_fields[group] = field
+			alternatives.append(pattern.replace('(?P<value>', f'(?P<{group}>', 1))
+			if field not in self.fields:
+				self.fields.append(field)
+		self.regex = re.compile('|'.join(alternatives), re.MULTILINE)
+
+	def extract(self, text):
+		values = dict.fromkeys(self.fields)
+		remaining = len(self.fields)
+		for match in self.regex.finditer(text or ''):
+			# An optional value group can match nothing
+			if match.lastgroup is None:
+				continue
+			field = self.group_fields[match.lastgroup]
+			if values[field] is None:
+				values[field] = match.group(match.lastgroup)
+				remaining -= 1
+				if not remaining:
+					break
+		return values
+
+RAW_SHOW_VERSION = RawTextExtractor(RAW_SHOW_VERSION_PATTERNS)
+
+# Fields every extractor spec must have, they are the columns of the report
+REQUIRED_FIELDS = ('software_version', 'uptime', 'serial_number')
+
+# Extractors ready to use, keyed by OS or by '<os>-<platform>':
+# { device_os : {'fields' : [(field, [source, ...]), ...], 'raw' : {command : RawTextExtractor}} }
+COMPILED_EXTRACTORS = {}
+
+"""
+This function prepares one source of an extractor spec, so nothing has to
+be interpreted again for each device.
+	('path', command, keys, templates, format)  templates[i] is True if keys[i] has a {field}
+	('pattern', command, field, None, format)   the value comes from the raw extractor
+"""
+def compile_source(field, spec):
+	if 'pattern' in spec:
+		return ('pattern', spec['source'], field, None, spec.get('format'))
+
+	keys = tuple(spec['path'])
+	templates = tuple('{' in key for key in keys)
+	return ('path', spec['source'], keys, templates, spec.get('format'))
+
+"""
+This function adds (or replaces) the extractor spec of a platform.
+	register_extractor('nxos-aci', {field : [source, ...], ...})
+"""
+def register_extractor(device_os, spec):
+	missing = [field for field in REQUIRED_FIELDS if field not in spec]
+	if missing:
+		raise ValueError(f'The extractor of {device_os} has no {", ".join(missing)}')
+	INVENTORY_EXTRACTORS[device_os] = spec
+
+	# One raw extractor per command, with the patterns of every field
+	raw_patterns = {}
+	for field, sources in spec.items():
+		for source in sources:
+			if 'pattern' in source:
+				raw_patterns.setdefault(source['source'], []).append((field, source['pattern']))
+
+	COMPILED_EXTRACTORS[device_os] = {
+		'fields' : [
+			(field, [compile_source(field, source) for source in sources])
+			for field, sources in spec.items()
+			],
+		'raw' : {
+			command : RawTextExtractor(patterns)
+			for command, patterns in raw_patterns.items()
+			}
+		}
+
+"""
+This function registers the extractor specs found in a JSON file.
+	{ device_os | 'os-platform' : { field : [source, ...] } }
+"""
+def load_extractors(filename):
+	with open(filename) as f:
+		for device_os, spec in json.load(f).items():
+			register_extractor(device_os, spec)
+
+"""
+This function applies one compiled source to the command outputs.
+'raw_values' returns the fields found in the raw output of a command.
+It returns None when the value is not there.
+"""
+def extract_value(source, outputs, fields, raw_values):
+	kind, command, target, templates, value_format = source
+	result = outputs[command]
+
+	if kind == 'path':
+		if result['type'] != 'parsed':
+			return None
+		value = result['output']
+		for key, template in zip(target, templates):
+			if not isinstance(value, dict):
+				return None
+			value = value.get(key.format(**fields) if template else key)
+	else:
+		if result['type'] != 'raw':
+			return None
+		value = raw_values(command)[target]
+
+	if value is not None and value_format:
+		value = value_format.format(**value) if isinstance(value, dict) else value_format.format(value)
+	return value
+
+"""
+This function process device-specific information and 
+returns standardized output, using the extractor of its platform or, if
+there is none, of its OS. It returns False if the OS is not supported.
+"""
 def get_inventory(device, show_version, show_inventory):
 	# Common information for all devices
 	hostname = device.name
 	device_os = device.os
 
-	if device_os == 'iosxr':
-		software_version = show_version[hostname]['output']['software_version']
-		uptime = show_version[hostname]['output']['uptime']
-		# show_inventory is empty
-		try:
-			serial_number = show_inventory[hostname]['output']['module_name']['0/0/CPU0']['sn']
-		except:
-			serial_number = 'N/A'
-	elif device_os == 'iosxe':
-		model = show_version[hostname]['output']['version']['chassis']
-		software_version = show_version[hostname]['output']['version']['version']
-		uptime = show_version[hostname]['output']['version']['uptime']
-		# show_inventory is empty
-		try:
-			serial_number = show_inventory[hostname]['output']['main']['chassis'][model]['sn']
-		except:
-			serial_number = 'N/A'
-	elif device_os == 'nxos':
-		software_version = show_version[hostname]['output']['platform']['software']['system_version']
-		uptime_dic = show_version[hostname]['output']['platform']['kernel_uptime']
-		uptime = f"{uptime_dic['days']} days, {uptime_dic['hours']} hours, {uptime_dic['minutes']} minutes"
-		try:
-			serial_number = show_inventory[hostname]['output']['name']['Chassis']['serial_number']
-		except:
-			serial_number = 'N/A'
-	elif device_os == 'asa':
-		raw_output = show_version[hostname]['output']
-		software_version = search_between('Software Version ', '\r\n', raw_output)
-		uptime = search_between(f'{hostname} up ', '\r\n', raw_output)
-		try:
-			serial_number = show_inventory[hostname]['output']['Chassis']['sn']
-		except:
-			serial_number = 'N/A'
-	elif device_os == 'ios':
-		software_version = show_version[hostname]['output']['version']['version']
-		uptime = show_version[hostname]['output']['version']['uptime']
-		serial_number = show_version[hostname]['output']['version']['chassis_sn']
-	else:
+	extractor = COMPILED_EXTRACTORS.get(f'{device_os}-{getattr(device, "platform", None)}')
+	if extractor is None:
+		extractor = COMPILED_EXTRACTORS.get(device_os)
+	if extractor is None:
 		return False
 
-	return (hostname, device_os, software_version, uptime, serial_number)
+	outputs = {
+		'show_version' : show_version[hostname],
+		'show_inventory' : show_inventory[hostname]
+		}
 
-# If run as a script
-if __name__ == '__main__':
-	import argparse
+	# Each raw output is scanned once, the first time a field needs it
+	raw_results = {}
+	def raw_values(command):
+		if command not in raw_results:
+			raw_results[command] = extractor['raw'][command].extract(outputs[command]['output'])
+		return raw_results[command]
+
+	fields = {}
+	for field, sources in extractor['fields']:
+		value = None
+		for source in sources:
+			value = extract_value(source, outputs, fields, raw_values)
+			if value is not None:
+				break
+
+		# Parser not available, try the common raw patterns
+		if value is None and outputs['show_version']['type'] == 'raw':
+			if 'generic' not in raw_results:
+				raw_results['generic'] = RAW_SHOW_VERSION.extract(outputs['show_version']['output'])
+			value = raw_results['generic'].get(field)
 
-	# Empty dictionary to store the output of the 'show version' command
-	# { hostname : {type : output} }
-	show_version = {}
+		fields[field] = 'N/A' if value is None else value
 
-	# Empty dictionary to store the output of the 'show inventory' command
-	# { hostname : {type : output} }
-	show_inventory = {}
+	return (hostname, device_os, fields['software_version'], fields['uptime'], fields['serial_number'])
 
-	# List of fields in network inventory report
-	network_inventory = []
+# Compile the built-in extractors once
+for device_os, spec in list(INVENTORY_EXTRACTORS.items()):
+	register_extractor(device_os, spec)
+
+"""
+This function returns the names of the devices listed in the 'hostname'
+column of a CSV or XLSX file, like the spreadsheet used to create the
+testbed (nso_sandbox_devices.xlsx).
+"""
+def read_device_names(filename):
+	return {row['hostname'] for row in iter_table_rows(filename) if row.get('hostname')}
+
+"""
+This function returns the testbed devices selected by a device list file.
+Without a file, every device in the testbed is selected.
+"""
+def select_devices(testbed, devices_filename=None):
+	if not devices_filename:
+		return list(testbed.devices.values())
+
+	print(f'Reading device list {devices_filename}')
+	names = read_device_names(devices_filename)
+	for name in sorted(names - set(testbed.devices)):
+		print(f'WARNING: Device {name} is not in the testbed')
+	return [device for device in testbed.devices.values() if device.name in names]
+
+"""
+This function reads a previous inventory report, in any report format.
+It returns the records by device name. Reports written before records had
+a collection time get the time of that run, taken from the timestamp in the
+filename or, if missing, from the file itself.
+	{ device_name : {'device_os' : os, 'software_version' : version, 'collected_at' : time, ...} }
+"""
+def read_previous_inventory(filename):
+	records = {row['device_name'] : row for row in read_records(filename)}
+
+	try:
+		run_time = datetime.strptime(os.path.basename(filename)[:19], '%Y-%m-%d-%H-%M-%S')
+	except ValueError:
+		run_time = datetime.fromtimestamp(os.path.getmtime(filename))
+
+	for record in records.values():
+		if not record.get('collected_at'):
+			record['collected_at'] = run_time.isoformat(timespec='seconds')
+	return records
+
+"""
+This function decides if a device kept running since the previous report.
+The boot time of the device is estimated from each record, collection time
+minus uptime, so it does not matter when each device was reached within its
+run. It has not been rebooted when the boot time did not move forward.
+The tolerance covers uptimes rounded to minutes and clock differences.
+"""
+def is_unchanged(record, previous, collected_at, tolerance=300):
+	if previous['device_os'] != record[1] or previous['software_version'] != record[2]:
+		return False
+	if previous['serial_number'] in ('', 'N/A'):
+		return False
+
+	uptime = uptime_to_seconds(record[3])
+	previous_uptime = uptime_to_seconds(previous['uptime'])
+	if uptime is None or previous_uptime is None:
+		return False
+
+	try:
+		previous_time = datetime.fromisoformat(previous['collected_at'])
+	except ValueError:
+		return False
+
+	boot_time = collected_at.timestamp() - uptime
+	previous_boot_time = previous_time.timestamp() - previous_uptime
+	return boot_time <= previous_boot_time + tolerance
+
+"""
+This function collects the inventory record of a single device.
+It connects, runs the show commands, builds the record and disconnects,
+so it can be run for many devices at the same time.
+Devices whose commands are all in the cache are not connected at all.
+With the record of a previous run, 'show inventory' is skipped when
+'show version' proves the device has not changed, and the previous serial
+number is reused. The record ends with the time it was collected.
+"""
+def collect_device(device, cache=None, previous=None):
+	collected_at = datetime.now()
+	timestamp = (collected_at.isoformat(timespec='seconds'),)
+	try:
+		# Run commands to gather information from network device
+		if previous:
+			show_version = {device.name : parse_command(device, 'show version', cache)}
+			show_inventory = {device.name : {'type' : 'skipped', 'output' : {}}}
+			record = get_inventory(device, show_version, show_inventory)
+			if record and is_unchanged(record, previous, collected_at):
+				print(f'{device.name} has not changed, reusing its serial number')
+				return record[:4] + (previous['serial_number'],) + timestamp
+
+			show_inventory = {device.name : parse_command(device, 'show inventory', cache)}
+		else:
+			# Both commands in a single round trip
+			results = parse_commands(device, ['show version', 'show inventory'], cache)
+			show_version = {device.name : results['show version']}
+			show_inventory = {device.name : results['show inventory']}
+
+		# Build network inventory
+		record = get_inventory(device, show_version, show_inventory)
+		return record and record + timestamp
+	finally:
+		# Disconnect from device
+		if device.is_connected():
+			device.disconnect()
+			print(f'Disconnected successfully from {device.name}')
+
+# If run as a script
+if __name__ == '__main__':
+	import argparse
 
 	# Read testbed filename
 	parser = argparse.ArgumentParser(description='testing pyATS')
-	parser.add_argument('testbed', type=str, 
+	parser.add_argument('testbed', type=str, nargs='?', 
 		help='pyATS testbed filename')
 	parser.add_argument('--aci-address', type=str, 
 		help='IP addres of the APIC')
 	parser.add_argument('--sdwan-address', type=str, 
 		help='IP address of the SD-WAN controller')
+	parser.add_argument('--workers', type=int, default=1, 
+		help='Number of devices to collect information from at the same time')
+	parser.add_argument('--session-cache', type=str, 
+		help='JSON file to keep controller sessions between runs')
+	parser.add_argument('--cache', type=str, metavar='DIRECTORY', 
+		help='Directory to cache command outputs between runs')
+	parser.add_argument('--cache-ttl', type=int, default=86400, 
+		help='Seconds a cached command output is valid (default: 1 day)')
+	parser.add_argument('--cache-size', type=int, default=10000, 
+		help='Maximum number of cached command outputs')
+	cache_group = parser.add_mutually_exclusive_group()
+	cache_group.add_argument('--refresh', action='store_true', 
+		help='Run every command and update the cache')
+	cache_group.add_argument('--cache-only', action='store_true', 
+		help='Do not connect to devices, only use the cache')
+	parser.add_argument('--extractors', type=str, metavar='JSON_FILE', 
+		help='Extra extractor specs for new platforms')
+	parser.add_argument('--incremental', type=str, metavar='PREVIOUS_CSV', 
+		help='Skip show inventory on devices that did not change since this report')
+	parser.add_argument('--format', choices=FILE_EXTENSIONS.keys(), 
+		help='Format of the report (default: csv, or the format of the resumed report)')
+	parser.add_argument('--resume', type=str, metavar='REPORT', 
+		help='Continue an interrupted report, skipping the devices already in it')
+	parser.add_argument('--history', type=str, metavar='DATABASE', 
+		help='Add the report to this inventory history database')
+	replay_group = parser.add_mutually_exclusive_group()
+	replay_group.add_argument('--record', type=str, metavar='ARCHIVE', 
+		help='Record every device and API interaction to this archive')
+	replay_group.add_argument('--replay', type=str, metavar='ARCHIVE', 
+		help='Run from a recorded archive, without network')
+	parser.add_argument('--broker', type=str, metavar='SOCKET', 
+		help='Use the warm device sessions of a device_broker.py process')
+	parser.add_argument('--devices', type=str, metavar='DEVICE_LIST', 
+		help='Only collect the devices in the hostname column of this CSV or XLSX file')
 	args = parser.parse_args()
 
+	if not args.testbed and not args.replay and not args.broker:
+		parser.error('a testbed file is required, unless --replay or --broker is used')
+	if args.broker and args.replay:
+		parser.error('--broker and --replay cannot be used together')
+	if (args.refresh or args.cache_only) and not args.cache:
+		parser.error('--refresh and --cache-only require --cache DIRECTORY')
+
+	# A resumed report keeps the format it was written in
+	output_format = args.format or 'csv'
+	if args.resume:
+		output_format = report_format(args.resume)
+		if args.format and args.format != output_format:
+			parser.error(f'--format {args.format} does not match the {output_format} report {args.resume}')
+
+	# Support for new platforms
+	if args.extractors:
+		load_extractors(args.extractors)
+
 	# Load testbed file
-	print(f'Loading {args.testbed} file')
-	testbed = load(args.testbed)
+	archive = None
+	if args.replay:
+		print(f'Replaying {args.replay}')
+		archive = ReplayArchive(args.replay)
+		testbed = ReplayTestbed(archive)
+	else:
+		if args.broker:
+			print(f'Using the device broker at {args.broker}')
+			testbed = BrokerTestbed(args.broker)
+		else:
+			print(f'Loading {args.testbed} file')
+			testbed = load(args.testbed)
+
+		if args.record:
+			print(f'Recording to {args.record}')
+			archive = ReplayArchive(args.record, 'w')
+			testbed = RecordingTestbed(testbed, archive)
 
 	# It is very common that network devices use self-signed certificates, 
 	# which would stop the program from working.
 	disable_warnings(exceptions.InsecureRequestWarning)
 
+	# Network inventory output filename
+	now = datetime.now()
+	if args.resume:
+		inventory_filename = args.resume
+	else:
+		extension = FILE_EXTENSIONS[output_format]
+		inventory_filename = f'{now.strftime("%Y-%m-%d-%H-%M-%S")}_{testbed.name}_inventory.{extension}'
+
+	# Open the report now, so records are written as they are collected
+	print(f'Writing to {inventory_filename}')
+	sink = make_sink(inventory_filename, output_format, resume=bool(args.resume))
+	if sink.written:
+		print(f'Resuming report, {len(sink.written)} devices were already collected')
+
+	# One authenticated session per controller
+	controller_sessions = ControllerSessions(args.session_cache, archive=archive)
+
+	# There is nothing to ask for when the controllers are replayed
+	credentials = ask_credentials
+	if args.replay:
+		credentials = lambda address: ('replay', 'replay')
+
 	if args.aci_address:
 		print(f'\nConnecting to {args.aci_address}')
-		# Read credentials from the user
-		aci_username = input(f'What is the username for {args.aci_address}? ')
-		aci_password = getpass(f'Enter the password (input will be hidden): ')
+		# Read credentials from the user, only if a new login is needed
+		aci_session = controller_sessions.aci(
+			args.aci_address, 
+			lambda: credentials(args.aci_address)
+			)
 	
 		print('Making API calls')
-		aci_info = get_aci_info(args.aci_address, aci_username, aci_password)
+		aci_info = aci_session and get_aci_info(aci_session, args.aci_address)
 
 		# Debugging information
 		#print(aci_info)
 
-		# Merging aci_info with network_inventory
-		network_inventory += aci_info
+		# Writing aci_info to the report
+		for device_info in aci_info or []:
+			sink.write(device_info + (datetime.now().isoformat(timespec='seconds'),))
 	
 	if args.sdwan_address: 
 		print(f'\nConnecting to {args.sdwan_address}')
-		# Read credentials from the user
-		sdwan_username = input(f'What is the username for {args.sdwan_address}? ')
-		sdwan_password = getpass(f'Enter the password (input will be hidden): ')
+		# Read credentials from the user, only if a new login is needed
+		sdwan_session = controller_sessions.sdwan(
+			args.sdwan_address, 
+			lambda: credentials(args.sdwan_address)
+			)
 
 		print('Making API calls')
-		sdwan_info = get_sdwan_info(args.sdwan_address, sdwan_username, sdwan_password)
+		# Each device reaches the report as soon as it is received
+		if sdwan_session:
+			for device_info in get_sdwan_info(sdwan_session, args.sdwan_address):
+				# Debugging information
+				#print(device_info)
+				sink.write(device_info + (datetime.now().isoformat(timespec='seconds'),))
 
-		# Debugging information
-		#print(sdwan_info)
-		
-		# Merging sdwan_info with network_inventory 
-		network_inventory += sdwan_info
+	# Log out, or save the sessions for the next run
+	controller_sessions.close()
 
-	# Connect to all devices, but silent logs
-	print(f'\nConnecting to all devices in {testbed.name}')
-	testbed.connect(log_stdout=False)
+	# Cache of parsed outputs
+	cache = None
+	if args.cache:
+		if args.refresh:
+			cache_mode = 'refresh'
+		elif args.cache_only:
+			cache_mode = 'only'
+		else:
+			cache_mode = 'normal'
+		cache = ParseCache(args.cache, args.cache_ttl, args.cache_size, cache_mode)
 
-	# testbed.devices = { hostname : <Device object> }
-	for device in testbed.devices.values():
-		# Run commands to gather information from network device
-		show_version[device.name] = parse_command(device,'show version')
-		# pprint(show_version)
-		show_inventory[device.name] = parse_command(device, 'show inventory')
-		# pprint(show_inventory)
+	# Records of the previous report
+	previous_inventory = {}
+	if args.incremental:
+		print(f'Reading previous report {args.incremental}')
+		previous_inventory = read_previous_inventory(args.incremental)
 
-		# Build network inventory
-		#print(get_inventory(device, show_version, show_inventory))
-		network_inventory.append(get_inventory(device, show_version, show_inventory))
-		
-		# Disconnect from device
-		device.disconnect()
-		print(f'Disconnected successfully from {device.name}')
+	# Connect to many devices at once. A slow device only holds its own worker.
+	print(f'\nCollecting information from all devices in {testbed.name} ({args.workers} workers)')
+	with ThreadPoolExecutor(max_workers=args.workers) as executor:
+		# testbed.devices = { hostname : <Device object> }
+		futures = {
+			executor.submit(
+				collect_device, 
+				device, 
+				cache, 
+				previous_inventory.get(device.name)
+				) : device
+			for device in select_devices(testbed, args.devices)
+			# Devices in the resumed report are not collected again
+			if device.name not in sink.written
+			}
 
+		# Each record is written as soon as its device finishes
+		for future in as_completed(futures):
+			device = futures[future]
+			try:
+				sink.write(future.result())
+			except Exception as e:
+				print(f'Error: Failed to collect information from {device.name}')
+				print(e)
 
-	# Network inventory output filename
-	now = datetime.now()
-	inventory_filename = f'{now.strftime("%Y-%m-%d-%H-%M-%S")}_{testbed.name}_inventory.csv'
+	# Remove old entries from the cache
+	if cache:
+		cache.prune()
 
-	# Write to a CSV file
-	print(f'Writing to {inventory_filename}')
+	sink.close()
 
-	with open(inventory_filename, 'w', newline='') as csvfile:
-		writer = csv.writer(csvfile, dialect='excel')
-		writer.writerow(('device_name', 'device_os', 'software_version', 'uptime', 'serial_number'))
+	# Keep this run in the history store
+	if args.history:
+		print(f'Adding {inventory_filename} to {args.history}')
+		with InventoryHistory(args.history) as history:
+			history.ingest(inventory_filename)
 
-		for device_info in network_inventory:
-			writer.writerow(device_info)
+	if archive:
+		archive.close()
@@ -0,0 +1,358 @@
+"""
+This module records the input/output of a run into a replay archive, so the
+same run can be repeated later without any network access.
+
+Recorded interactions
+	* Device methods: parse, execute, learn, configure and api calls.
+	* HTTP requests made through a requests session (ACI, SD-WAN).
+
+The archive is a gzip compressed JSON Lines file, one interaction per line:
+	{'kind' : 'testbed', 'name' : testbed_name}
+	{'kind' : 'device', 'device' : name, 'os' : os, 'platform' : platform,
+	 'method' : 'parse', 'command' : command, 'result' : output, 'error' : None}
+	{'kind' : 'http', 'method' : 'GET', 'url' : url, 'status' : 200,
+	 'headers' : {...}, 'cookies' : {...}, 'body' : text}
+
+web02 uses this same file through a symbolic link, so there is a single
+copy to change.
+
+Usage
+	# Record a real run
+	archive = ReplayArchive('run.jsonl.gz', 'w')
+	testbed = RecordingTestbed(load('testbed.yaml'), archive)
+	archive.mount(session)
+
+	# Repeat it without network
+	archive = ReplayArchive('run.jsonl.gz')
+	testbed = ReplayTestbed(archive)
+	archive.mount(session)
+"""
+
+from collections import OrderedDict, defaultdict
+from types import SimpleNamespace
+import threading
+import gzip
+import json
+import io
+
+# HTTP interactions are only available if requests is installed
+try:
+	import requests.adapters
+	import requests.cookies
+	import requests.structures
+	import requests.utils
+except ImportError:
+	requests = None
+
+"""
+This function rebuilds an exception from its recorded class name.
+Parser exceptions are rebuilt with their real genie class, so scripts can
+still catch them. Any other error is raised as a RuntimeError.
+"""
+def raise_recorded_error(name, message):
+	error_classes = {}
+	try:
+		from genie.metaparser.util.exceptions import SchemaEmptyParserError
+		from genie.libs.parser.utils.common import ParserNotFound
+		error_classes = {
+			'SchemaEmptyParserError' : SchemaEmptyParserError,
+			'ParserNotFound' : ParserNotFound
+			}
+	except ImportError:
+		pass
+
+	if name in error_classes:
+		# Skip the constructor, each genie exception has its own arguments
+		error = error_classes[name].__new__(error_classes[name])
+		Exception.__init__(error, message)
+		raise error
+	raise RuntimeError(f'{name}: {message}')
+
+"""
+This function returns a key for a command, which can be a string or a list.
+"""
+def command_key(command):
+	if isinstance(command, str):
+		return command
+	return json.dumps(command)
+
+"""
+This class reads or writes a replay archive.
+	mode = 'w'  record interactions
+	mode = 'r'  load interactions to replay them
+"""
+class ReplayArchive:
+	def __init__(self, filename, mode='r'):
+		self.filename = filename
+		self.mode = mode
+		self.lock = threading.Lock()
+		self.testbed_name = 'replay'
+		# { device_name : (os, platform) }
+		self.devices = OrderedDict()
+		# { (device, method, command) : [entry, entry, ...] }
+		self.device_entries = defaultdict(list)
+		# { (method, url) : [entry, entry, ...] }
+		self.http_entries = defaultdict(list)
+
+		if mode == 'w':
+			self.file = gzip.open(filename, 'wt')
+		else:
+			self.file = None
+			self.load()
+
+	def load(self):
+		with gzip.open(self.filename, 'rt') as f:
+			for line in f:
+				entry = json.loads(line)
+				if entry['kind'] == 'testbed':
+					self.testbed_name = entry['name']
+				elif entry['kind'] == 'device':
+					# Archives recorded before platforms were kept have none
+					self.devices.setdefault(entry['device'], (entry['os'], entry.get('platform')))
+					key = (entry['device'], entry['method'], entry['command'])
+					self.device_entries[key].append(entry)
+				elif entry['kind'] == 'http':
+					self.http_entries[(entry['method'], entry['url'])].append(entry)
+
+	"""
+	This method writes one interaction. It is safe to call from many threads.
+	"""
+	def record(self, entry):
+		line = json.dumps(entry, default=str)
+		with self.lock:
+			self.file.write(line + '\n')
+
+	"""
+	This method returns the next recorded entry for a key.
+	Interactions are replayed in the same order they were recorded, and the
+	last one is repeated if the script asks more times than recorded.
+	"""
+	def next_entry(self, entries, key):
+		with self.lock:
+			if key not in entries:
+				raise KeyError(f'{key} was not recorded in {self.filename}')
+			if len(entries[key]) > 1:
+				return entries[key].pop(0)
+			return entries[key][0]
+
+	"""
+	This method makes a requests session record, or replay, its HTTP calls.
+	"""
+	def mount(self, session):
+		if self.mode == 'w':
+			adapter = RecordingAdapter(self)
+		else:
+			adapter = ReplayAdapter(self)
+		session.mount('https://', adapter)
+		session.mount('http://', adapter)
+
+	def close(self):
+		if self.file:
+			self.file.close()
+			self.file = None
+
+if requests:
+	"""
+	This adapter sends requests as usual and records every response.
+	"""
+	class RecordingAdapter(requests.adapters.HTTPAdapter):
+		def __init__(self, archive, **kwargs):
+			super().__init__(**kwargs)
+			self.archive = archive
+
+		def send(self, request, **kwargs):
+			response = super().send(request, **kwargs)
+			self.archive.record({
+				'kind' : 'http',
+				'method' : request.method,
+				'url' : request.url,
+				'status' : response.status_code,
+				'headers' : dict(response.headers),
+				'cookies' : response.cookies.get_dict(),
+				# Reading the content is fine, it is cached by the response
+				'body' : response.content.decode('utf-8', 'replace')
+				})
+			return response
+
+	"""
+	This adapter answers requests from the archive, without any network.
+	"""
+	class ReplayAdapter(requests.adapters.BaseAdapter):
+		def __init__(self, archive):
+			super().__init__()
+			self.archive = archive
+
+		def send(self, request, **kwargs):
+			entry = self.archive.next_entry(
+				self.archive.http_entries,
+				(request.method, request.url)
+				)
+
+			response = requests.models.Response()
+			response.status_code = entry['status']
+			response.headers = requests.structures.CaseInsensitiveDict(entry['headers'])
+			response.encoding = requests.utils.get_encoding_from_headers(response.headers)
+			response.cookies = requests.cookies.cookiejar_from_dict(entry['cookies'])
+			response.raw = io.BytesIO(entry['body'].encode('utf-8'))
+			response.url = request.url
+			response.request = request
+			response.reason = 'Replayed'
+			return response
+
+		def close(self):
+			pass
+
+"""
+This class records the api calls of a device, for example
+device.api.configure_lldp().
+"""
+class RecordingApi:
+	def __init__(self, device):
+		self.device = device
+
+	def __getattr__(self, name):
+		def call(*args, **kwargs):
+			return self.device.call('api', name, getattr(self.device.device.api, name), *args, **kwargs)
+		return call
+
+"""
+This class wraps a pyATS device and records the result of every command.
+Anything else is passed to the real device.
+"""
+class RecordingDevice:
+	def __init__(self, device, archive):
+		self.device = device
+		self.archive = archive
+		self.api = RecordingApi(self)
+
+	def __getattr__(self, name):
+		# Raw channel access would not be recorded, so it is hidden and
+		# scripts fall back to execute
+		if name in ('transmit', 'receive', 'receive_buffer'):
+			raise AttributeError(name)
+		return getattr(self.device, name)
+
+	def call(self, method, command, function, *args, **kwargs):
+		entry = {
+			'kind' : 'device',
+			'device' : self.device.name,
+			'os' : self.device.os,
+			'platform' : getattr(self.device, 'platform', None),
+			'method' : method,
+			'command' : command_key(command),
+			'result' : None,
+			'error' : None
+			}
+		try:
+			result = function(*args, **kwargs)
+		except Exception as e:
+			entry['error'] = [type(e).__name__, str(e)]
+			self.archive.record(entry)
+			raise
+
+		# Ops objects (learn) are recorded by their info dictionary
+		entry['result'] = result.info if method == 'learn' else result
+		self.archive.record(entry)
+		return result
+
+	def parse(self, command, **kwargs):
+		return self.call('parse', command, self.device.parse, command, **kwargs)
+
+	def execute(self, command, **kwargs):
+		return self.call('execute', command, self.device.execute, command, **kwargs)
+
+	def learn(self, feature, **kwargs):
+		return self.call('learn', feature, self.device.learn, feature, **kwargs)
+
+	def configure(self, config, **kwargs):
+		return self.call('configure', config, self.device.configure, config, **kwargs)
+
+"""
+This class wraps a pyATS testbed, so all its devices are recorded.
+"""
+class RecordingTestbed:
+	def __init__(self, testbed, archive):
+		self.testbed = testbed
+		self.name = testbed.name
+		self.devices = OrderedDict(
+			(name, RecordingDevice(device, archive))
+			for name, device in testbed.devices.items()
+			)
+		archive.record({'kind' : 'testbed', 'name' : testbed.name})
+
+	def __getattr__(self, name):
+		return getattr(self.testbed, name)
+
+"""
+This class replays the api calls of a device.
+"""
+class ReplayApi:
+	def __init__(self, device):
+		self.device = device
+
+	def __getattr__(self, name):
+		def call(*args, **kwargs):
+			return self.device.replay('api', name)
+		return call
+
+"""
+This class behaves like a pyATS device, but every result comes from the
+archive. Connecting and disconnecting do nothing.
+"""
+class ReplayDevice:
+	def __init__(self, name, os, archive, platform=None):
+		self.name = name
+		self.os = os
+		self.platform = platform
+		self.archive = archive
+		self.connected = False
+		self.api = ReplayApi(self)
+
+	def __str__(self):
+		return self.name
+
+	def connect(self, **kwargs):
+		self.connected = True
+
+	def disconnect(self):
+		self.connected = False
+
+	def is_connected(self):
+		return self.connected
+
+	def replay(self, method, command):
+		entry = self.archive.next_entry(
+			self.archive.device_entries,
+			(self.name, method, command_key(command))
+			)
+		if entry['error']:
+			raise_recorded_error(*entry['error'])
+		return entry['result']
+
+	def parse(self, command, **kwargs):
+		return self.replay('parse', command)
+
+	def execute(self, command, **kwargs):
+		return self.replay('execute', command)
+
+	def learn(self, feature, **kwargs):
+		# Scripts only read the info attribute of Ops objects
+		return SimpleNamespace(info=self.replay('learn', feature))
+
+	def configure(self, config, **kwargs):
+		return self.replay('configure', config)
+
+"""
+This class behaves like a pyATS testbed built from a replay archive.
+"""
+class ReplayTestbed:
+	def __init__(self, archive):
+		self.name = archive.testbed_name
+		self.devices = OrderedDict(
+			(name, ReplayDevice(name, os, archive, platform))
+			for name, (os, platform) in archive.devices.items()
+			)
+
+	def connect(self, **kwargs):
+		for device in self.devices.values():
+			device.connect()
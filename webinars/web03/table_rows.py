@@ -0,0 +1,50 @@
+"""
+This module reads the rows of a CSV file or an XLSX workbook, for the
+source of truth and the device lists of the scripts.
+
+web01 and web02 use this same file through a symbolic link, so there is a
+single copy to change.
+
+Usage
+	for row in iter_table_rows('nso_sandbox_devices.xlsx'):
+		print(row)
+"""
+
+import csv
+
+# Optional dependency, only needed to read XLSX files
+try:
+	import openpyxl
+except ImportError:
+	openpyxl = None
+
+"""
+This function yields the rows of a CSV or XLSX file as dictionaries, one at
+a time. XLSX workbooks are opened in read-only mode, which streams the rows
+from the file instead of loading the whole workbook. The first row of the
+active sheet is the header.
+	{column : value, column : value, ...}
+"""
+def iter_table_rows(filename):
+	if not filename.lower().endswith('.xlsx'):
+		with open(filename, newline='') as csvfile:
+			yield from csv.DictReader(csvfile)
+		return
+
+	if openpyxl is None:
+		raise ImportError('XLSX files require openpyxl (pip install openpyxl)')
+
+	workbook = openpyxl.load_workbook(filename, read_only=True, data_only=True)
+	try:
+		rows = workbook.active.iter_rows(values_only=True)
+		header = ['' if value is None else str(value) for value in next(rows, ())]
+		for values in rows:
+			# Empty cells are read as None, like empty CSV fields they become ''
+			row = dict.fromkeys(header, '')
+			for column, value in zip(header, values):
+				if value is not None:
+					row[column] = str(value)
+			yield row
+	finally:
+		workbook.close()
+
@@ -15,29 +15,219 @@ Commands to run:
 	*NOTE: {ID} is read from command line arguments.
 
 It is supposed to be run whenever an ethernet interface goes down or comes up. 
+
+Capture modes (--capture), each command runs on the switch only once:
+	json  Run clid, write the JSON and a text file rendered from it (default).
+	      Commands without JSON support fall back to raw output.
+	raw   Run cli and only write the raw text.
+	both  Run cli and clid, as older versions of this script did. Use it when
+	      the exact CLI text is needed, every command runs twice.
+
+Commands run at the same time in a few worker threads (--workers), so the
+snapshot is taken as close as possible to the moment the event triggered.
+The start and end time of every command are written to timing.json.
+
+Reports are written gzip compressed (--compress), straight into the .gz files.
+After each run the oldest report folders are removed, so a flapping port can
+not fill bootflash. A folder is removed if it is not among the newest
+--keep-count reports, is older than --keep-days, or it and the reports
+newer than it take more than --max-bytes. Zero disables a limit. The new report is always kept.
+
+Usage
+	python bootflash:troubleshooting_assistant.py --ethernet ID [--capture json|raw|both]
+		[--workers N] [--compress gzip|none] [--keep-count N] [--keep-days N]
+		[--max-bytes N]
 """
 
 from cli import cli, clid
 from cli import structured_output_not_supported_error
+from collections import OrderedDict
 from datetime import datetime
 from os import mkdir
+import threading
+import shutil
+import json
+import gzip
+import os
+import re
+
+# The queue module was renamed in python 3
+try:
+	from queue import Queue, Empty
+except ImportError:
+	from Queue import Queue, Empty
+
+# Folder where reports are stored
+REPORTS_DIRECTORY = '/bootflash'
+
+# Name of the report folders, the timestamp sorts them by age
+REPORT_PATTERN = re.compile(r'^(\d{4}_\d{2}_\d{2}_\d{2}_\d{2}_\d{2})_ethernet_.+_report$')
+
+"""
+This function renders JSON data as indented text, one 'key: value' per line.
+It gives a readable .txt file without running the command again.
+"""
+def render_text(data, indent=0):
+	lines = []
+	padding = u'  ' * indent
+	if isinstance(data, dict):
+		for key, value in data.items():
+			if isinstance(value, (dict, list)):
+				lines.append(u'{padding}{key}:'.format(padding=padding, key=key))
+				lines.extend(render_text(value, indent + 1))
+			else:
+				lines.append(u'{padding}{key}: {value}'.format(padding=padding, key=key, value=value))
+	elif isinstance(data, list):
+		# Rows of a table
+		for position, item in enumerate(data):
+			lines.append(u'{padding}[{position}]'.format(padding=padding, position=position))
+			lines.extend(render_text(item, indent + 1))
+	else:
+		lines.append(u'{padding}{data}'.format(padding=padding, data=data))
+	return lines
 
 """
-This function gathers both raw and JSON data. It returns the result as a tuple.
+This function runs a command once, or twice with capture='both', and
+returns the result as a tuple.
+	(raw_data, json_data, rendered)
+	raw_data  text to write in the .txt file
+	json_data JSON text, False if it was not captured
+	rendered  True if raw_data was rendered from json_data
 """
-def run_command(command, interface):
-	raw_data = cli(command.format(id=interface))
+def run_command(command, interface, capture='json'):
+	command = command.format(id=interface)
+
+	if capture == 'raw':
+		return cli(command), False, False
 
 	# Not all commands are supported by clid
 	try:
-		json_data = clid(command.format(id=interface))
+		json_data = clid(command)
+	except structured_output_not_supported_error:
+		return cli(command), False, False
 	except Exception as e:
-		json_data = False
-	
-	return raw_data, json_data
+		print('WARNING: JSON output of "{command}" failed, using raw output'.format(command=command))
+		print(e)
+		return cli(command), False, False
+
+	if capture == 'both':
+		return cli(command), json_data, False
 
+	# Keep the order of the keys, like the switch shows them
+	data = json.loads(json_data, object_pairs_hook=OrderedDict)
+	return u'\n'.join(render_text(data)) + u'\n', json_data, True
 
 
+
+"""
+This function runs all the commands with a fixed number of worker threads.
+Each worker takes the next command from a queue until it is empty.
+It returns the result of each command and when it started and ended.
+	output = {filename : (raw_data, json_data, rendered)}
+	timing = {filename : {'command' : command, 'start' : time, 'end' : time, 'seconds' : N}}
+"""
+def run_commands(commands, interface, capture='json', workers=6):
+	output = {}
+	timing = {}
+	pending = Queue()
+	for filename, command in commands.items():
+		pending.put((filename, command))
+
+	def worker():
+		while True:
+			try:
+				filename, command = pending.get_nowait()
+			except Empty:
+				return
+
+			start = datetime.now()
+			try:
+				output[filename] = run_command(command, interface, capture)
+			except Exception as e:
+				# Keep the error in the report, the other commands still run
+				print('Error: "{command}" failed'.format(command=command.format(id=interface)))
+				print(e)
+				output[filename] = ('Error: {error}\n'.format(error=e), False, False)
+			end = datetime.now()
+
+			timing[filename] = {
+				'command' : command.format(id=interface),
+				'start' : start.isoformat(),
+				'end' : end.isoformat(),
+				'seconds' : (end - start).total_seconds()
+				}
+
+	threads = [threading.Thread(target=worker) for i in range(max(1, workers))]
+	for thread in threads:
+		thread.start()
+	for thread in threads:
+		thread.join()
+
+	return output, timing
+
+"""
+This function writes a report file, gzip compressed or not. The data is
+compressed while it is written, there is no uncompressed copy on bootflash.
+It returns the path of the file.
+"""
+def write_report_file(path_to_file, data, compress='gzip'):
+	# Text from cli() is bytes in python 2.7, text rendered from JSON is unicode
+	if not isinstance(data, bytes):
+		data = data.encode('utf-8')
+
+	if compress == 'gzip':
+		path_to_file += '.gz'
+		# A lower level saves CPU on a switch that is already struggling
+		report_file = gzip.open(path_to_file, 'wb', 6)
+	else:
+		report_file = open(path_to_file, 'wb')
+
+	print('Writing {file}'.format(file=path_to_file))
+	with report_file:
+		report_file.write(data)
+	return path_to_file
+
+"""
+This function returns the number of bytes used by the files of a folder.
+"""
+def folder_size(folder_name):
+	size = 0
+	for root, folders, files in os.walk(folder_name):
+		for filename in files:
+			size += os.path.getsize(os.path.join(root, filename))
+	return size
+
+"""
+This function removes the oldest report folders, to keep at most 'keep_count'
+reports, none older than 'keep_days' and at most 'max_bytes' in total.
+A limit of 0 is disabled. The report in 'current' is never removed.
+"""
+def prune_reports(directory, current, keep_count=0, keep_days=0, max_bytes=0):
+	reports = []
+	for name in os.listdir(directory):
+		match = REPORT_PATTERN.match(name)
+		if match and os.path.isdir(os.path.join(directory, name)):
+			created = datetime.strptime(match.group(1), '%Y_%m_%d_%H_%M_%S')
+			reports.append((created, name))
+	# Newest first
+	reports.sort(reverse=True)
+
+	now = datetime.now()
+	# Bytes used by this report and every newer one
+	total_bytes = 0
+	for position, (created, name) in enumerate(reports):
+		folder_name = os.path.join(directory, name)
+		total_bytes += folder_size(folder_name)
+
+		remove = (
+			(keep_count and position >= keep_count) or
+			(keep_days and (now - created).days >= keep_days) or
+			(max_bytes and total_bytes > max_bytes)
+			)
+		if remove and os.path.abspath(folder_name) != os.path.abspath(current):
+			print('Removing old report {folder}'.format(folder=folder_name))
+			shutil.rmtree(folder_name)
+
 if __name__ == '__main__':
 	import argparse
 
@@ -45,8 +235,24 @@ if __name__ == '__main__':
 	parser = argparse.ArgumentParser(description='Troubleshooting assistant')
 	parser.add_argument('--ethernet', metavar='ID', required=True, type=str, 
 		help='Ethernet interface ID')
+	parser.add_argument('--capture', choices=['json', 'raw', 'both'], default='json', 
+		help='How each command output is captured (default: json)')
+	parser.add_argument('--workers', type=int, default=6, 
+		help='Number of commands to run at the same time (default: 6)')
+	parser.add_argument('--compress', choices=['gzip', 'none'], default='gzip', 
+		help='Compression of the report files (default: gzip)')
+	parser.add_argument('--keep-count', type=int, default=20, 
+		help='Number of reports to keep, 0 for no limit (default: 20)')
+	parser.add_argument('--keep-days', type=int, default=30, 
+		help='Days to keep reports, 0 for no limit (default: 30)')
+	parser.add_argument('--max-bytes', type=int, default=50 * 1024 * 1024, 
+		help='Total size of the reports, 0 for no limit (default: 50 MB)')
 	args = parser.parse_args()
 
+	# Create a timestamp, as close as possible to the event
+	now = datetime.now()
+	timestamp = now.strftime('%Y_%m_%d_%H_%M_%S')
+
 	# Create a dictionary of commands. The key is used as filename.
 	commands = {
 		'show_interface' : 'show interface ethernet {id}',
@@ -57,22 +263,15 @@ if __name__ == '__main__':
 		'show_system_internal_interface' : 'show system internal interface ethernet {id} ethernet {id} event-history'
 		}
 
-	# Create a dictionary to store the output of each command.
-	output = {}
-
 	# Execute troubleshooting commands and store the output
 	print ('Running commands...')
-	for filename, command in commands.items():
-		output[filename] = run_command(command, args.ethernet)
-		# Debugging information
-		#print(run_command(command, args.ethernet))
-	
-	# Create a timestamp
-	now = datetime.now()
-	timestamp = now.strftime('%Y_%m_%d_%H_%M_%S')
+	output, timing = run_commands(commands, args.ethernet, args.capture, args.workers)
+	# Debugging information
+	#print(timing)
 
 	# Create a timestamped folder
-	folder_name = '/bootflash/{timestamp}_ethernet_{id}_report'.format(
+	folder_name = '{directory}/{timestamp}_ethernet_{id}_report'.format(
+		directory=REPORTS_DIRECTORY,
 		timestamp=timestamp,
 		id=args.ethernet.replace('/','_')
 		)
@@ -83,16 +282,14 @@ if __name__ == '__main__':
 	# Write the output of each command on a separate file
 	for filename, results in output.items():
 		# Unpacking the results
-		raw_data, json_data = results
+		raw_data, json_data, rendered = results
 
 		# Always write raw data
 		path_to_file = '{folder_name}/{filename}.txt'.format(
 				folder_name=folder_name,
 				filename=filename
 			)
-		print('Writing {file}'.format(file=path_to_file))
-		with open(path_to_file, 'w') as text_file:
-			text_file.write(raw_data)
+		write_report_file(path_to_file, raw_data, args.compress)
 
 		# Only write json_data if it exists
 		if json_data:
@@ -100,7 +297,12 @@ if __name__ == '__main__':
 					folder_name=folder_name,
 					filename=filename
 				)
-			print('Writing {file}'.format(file=path_to_file))
+			write_report_file(path_to_file, json_data, args.compress)
+
+	# Write when each command ran
+	path_to_file = '{folder_name}/timing.json'.format(folder_name=folder_name)
+	timing_data = json.dumps({'trigger' : now.isoformat(), 'commands' : timing}, indent=4)
+	write_report_file(path_to_file, timing_data, args.compress)
 
-			with open(path_to_file, 'w') as json_file:
-				json_file.write(json_data)
\ No newline at end of file
+	# Remove old reports, so bootflash does not fill up
+	prune_reports(REPORTS_DIRECTORY, folder_name, args.keep_count, args.keep_days, args.max_bytes)